@@ -33,6 +33,12 @@ def cli():
         action="store_true",
         help="Run program in dry-run mode"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached responses from previous runs and fetch "
+             "everything again"
+    )
     return parser.parse_args()
 
 
@@ -46,4 +52,11 @@ if __name__ == "__main__":
     # - docs.python.org/3/library/logging.config.html#logging.config.fileConfig
     logging.config.fileConfig("logging.ini", disable_existing_loggers=False)
     args = cli()
-    sys.exit(api.dispatch(args.directory, args.file, args.dry_run))
+    sys.exit(
+        api.dispatch(
+            args.directory,
+            args.file,
+            args.dry_run,
+            use_cache=not args.no_cache,
+        )
+    )
@@ -1,6 +1,15 @@
 """The APIs used by the crawlers."""
+import collections
+import concurrent.futures
+import functools
 import logging
+import os
+import pathlib
 import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
 
 from sylli_crawl.utils import helpers
 
@@ -8,6 +17,34 @@ from . import _globals
 
 logger = logging.getLogger(__name__)
 
+# classify a URL by the crawler needed to fetch it. the alternatives are
+# tried in order at the start of the URL, so a PDF hosted on youtube is
+# still treated as a PDF
+URL_CLASSIFIER = re.compile(
+    r"(?P<pdf>.*\.pdf\Z)"
+    r"|(?P<instagram>.*?instagram)"
+    r"|(?P<js>.*?(?:youtube|khan))"
+)
+
+# URL types we're unable to crawl atm
+UNSUPPORTED_URLS = {
+    "pdf": "a PDF",
+    "instagram": "an instagram page",
+}
+
+# one lock per website, held while a URL is fetched so concurrent fetches
+# never hit the same website at once
+_HOST_LOCKS = {}
+_HOST_LOCKS_GUARD = threading.Lock()
+# when each website can next be fetched from (time.monotonic), the
+# politeness wait is tracked here instead of being slept under the lock.
+# only read or written while holding the website's lock
+_HOST_NEXT_FETCH = {}
+
+# URLs handed to the fetch pool ahead of the one being yielded, per worker.
+# keeps the pool busy without queueing every URL up front
+QUEUED_FETCHES_PER_WORKER = 2
+
 
 def pages():
     """Randomly select the number of search engine pages to crawl.
@@ -21,9 +58,7 @@ def pages():
     :rtype: int
     """
     # pick a random number of pages to query
-    choice = random.choice(range(1, 102)) % len(_globals.PAGES)
-    # save this as a variable so we can log it
-    number_of_pages = _globals.PAGES[choice]
+    number_of_pages = random.choice(_globals.PAGES)
     logger.info("Parsing %s pages", number_of_pages)
     return number_of_pages
 
@@ -41,15 +76,20 @@ def process_files(directory):
         to be processed
     """
 
-    for file in directory.glob("*"):
-        if not file.name.startswith("_"):
-            yield file
+    # scandir entries carry their name so filtering needs no extra
+    # syscalls, unlike the Path objects produced by glob
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("_"):
+                continue
+
+            yield pathlib.Path(entry.path)
             # rename file once processed
-            new_file_name = f"_{file.name}"
+            new_file_name = f"_{entry.name}"
             logger.info(
                 "%s has been processed and will be renamed to %s",
-                file.name, new_file_name)
-            file.rename(directory / new_file_name)
+                entry.name, new_file_name)
+            os.rename(entry.path, os.path.join(directory, new_file_name))
 
 
 def construct_search_result_object(query, results, meta_data):
@@ -66,11 +106,12 @@ def construct_search_result_object(query, results, meta_data):
     # video results for a query are usually in the same area meaning you
     # are likely to get multiple youtube/vimeo links in a row. we want to
     # minimise this from happening so we dont get blocked by the website
-    random.shuffle(results)  # shuffles in place
+    # sample returns a shuffled copy, leaving the caller's list untouched
+    shuffled = random.sample(results, len(results))
     obj = {
         "query": query,
         "meta-data": meta_data,
-        "search-results": results,
+        "search-results": shuffled,
         # the index of the last discovered url,
         # this will be used later by the web crawlers
         # to save crawl progress
@@ -103,47 +144,146 @@ def update_save_json(path, data):
     helpers.write_json(pre_existing_data, path)
 
 
-def update_resource_data(path, data, key):
-    """Update resource JSON data.
+def read_resource_data(path, key):
+    """Read resource JSON data.
 
-    This is to update the file containing the eventual
-    data that will be fed to the backend.
+    This is the file containing the eventual data that will be fed
+    to the backend. Any data saved by a previous run is loaded so new
+    resources can be added to it in memory.
 
     :param pathlib.Path path: the path to JSON file
-    :param dict data: data to write to file
-    :param str key: key to save data under
+    :param str key: key the data is saved under
+    :returns: resource data
+    :rtype: dict
     """
     if path.exists():
-        pre_existing = helpers.read_json(path)
-    else:
-        pre_existing = {key: []}
+        return helpers.read_json(path)
 
     # Do we need the key? Each file only has one key in the dict
-    pre_existing[key].append(data)
-    helpers.write_json(pre_existing, path)
+    return {key: []}
+
+
+def cached_call(key, func, use_cache=False):
+    """Call a function through the on-disk cache.
+
+    This means re-runs and runs resumed after a crash do not go back over
+    the network for requests that have already been made.
+
+    :param str key: the key the result is cached under
+    :param callable func: function to call on a cache miss
+    :param bool use_cache: read from and write to the cache
+    :returns: the result and whether it was found in the cache
+    :rtype: tuple(object, bool)
+    """
+    if use_cache:
+        value = helpers.read_cache(key)
+        if value is not None:
+            logger.info("found cached result for %s", key)
+            return value, True
+
+    value = func()
+    # empty results are usually down to a failed request, dont keep them
+    if use_cache and value:
+        helpers.write_cache(key, value)
+    return value, False
+
+
+def fetch_engine_pages(
+    engine, query, number_of_pages, dry_run=False, use_cache=False
+):
+    """Fetch several pages of a query from a single search engine.
 
+    Pages are requested one after the other with a random wait after
+    each request, this means the politeness delay is per engine and a
+    slow or sleeping engine does not hold up the others.
 
-def fetch_query(query, result_set, page, dry_run=False):
+    :param crawler_base.Crawler engine: the search engine crawler
+    :param str query: the query to fetch
+    :param int number_of_pages: the number of pages to fetch
+    :param bool dry_run: dry run flag
+    :param bool use_cache: use cached search results
+
+    :returns: a set containing fetched urls
+    :rtype: set(str)
+    """
+    # normalise the query so trivially different queries share results
+    normalised_query = " ".join(query.lower().split())
+    result_set = set()
+    for page in range(1, number_of_pages + 1):
+        results, from_cache = cached_call(
+            f"{type(engine).__name__}:{normalised_query}:{page}",
+            functools.partial(
+                engine.fetch, query, page=page, dry_run=dry_run),
+            use_cache=use_cache and not dry_run,
+        )
+        if results and not dry_run:
+            # this makes sure we dont get duplicate resources
+            result_set.update(results)
+
+        # no need to be polite if we never made a request
+        if not dry_run and not from_cache:
+            helpers.wait(end=500)
+
+    return result_set
+
+
+def fetch_query(
+    query, result_set, number_of_pages, dry_run=False, use_cache=False
+):
     """Fetch a search engine query.
 
+    Each search engine is crawled in its own thread. The work is network
+    bound so a query costs roughly the time of the slowest engine rather
+    than the sum of all of them.
+
     :param str query: the query to fetch
     :param set result_set: the set to save fetched URLS
-    :param int page: the page number to fetch
+    :param int number_of_pages: the number of pages to fetch per engine
     :param bool dry_run: dry run flag
+    :param bool use_cache: use cached search results
 
     :returns: a set containing fetch urls
     :rtype: set(str)
     """
-    for se in _globals.CRAWLERS["engines"]:
-        results = se.fetch(query, page=page, dry_run=dry_run)
-        if results and not dry_run:
-            # this makes sure we dont get duplicate resources
-            for result in results:
-                result_set.add(result)
+    engines = _globals.CRAWLERS.engines
+    # one worker per engine, this keeps at most one in-flight request per
+    # search engine so we dont trigger their rate limiting
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(engines)
+    ) as executor:
+        futures = [
+            executor.submit(
+                fetch_engine_pages,
+                se,
+                query,
+                number_of_pages,
+                dry_run=dry_run,
+                use_cache=use_cache,
+            )
+            for se in engines
+        ]
+
+    for future in futures:
+        result_set.update(future.result())
 
     return result_set
 
 
+@functools.lru_cache(maxsize=4096)
+def classify_url(url):
+    """Classify a URL by the kind of crawler needed to fetch it.
+
+    The same URLs are seen again when a crawl is resumed, so the result
+    is cached.
+
+    :param str url: the URL to classify
+    :return: one of "pdf", "instagram", "js" or "html"
+    :rtype: str
+    """
+    match = URL_CLASSIFIER.match(url)
+    return match.lastgroup if match else "html"
+
+
 def fetch_url(url, dry_run=False):
     """Fetch a URL using a web crawler.
 
@@ -152,42 +292,136 @@ def fetch_url(url, dry_run=False):
     :return: fetched data
     :rtype: dict(str, str)
     """
+    url_type = classify_url(url)
     # exit early if url is a pdf or an instagram page
-    # as we're unable to crawl those atm
-    if url.endswith(".pdf"):
-        logger.warning("cannot parse, URL is a PDF: %s", url)
+    if url_type in UNSUPPORTED_URLS:
+        logger.warning(
+            "cannot parse, URL is %s: %s", UNSUPPORTED_URLS[url_type], url)
         return {}
 
-    if "instagram" in url:
-        logger.warning("cannot parse, URL is an instagram page: %s", url)
-        return {}
+    crawler = getattr(_globals.CRAWLERS, url_type)
+    return crawler.fetch(url, dry_run=dry_run)
 
-    if "youtube" in url or "khan" in url:
-        crawler = _globals.CRAWLERS["web"]["js"]
 
-    else:
-        crawler = _globals.CRAWLERS["web"]["html"]
+def _host_key(url):
+    """Get the key for the website a URL belongs to.
 
-    return crawler.fetch(url, dry_run=dry_run)
+    JavaScript sites are all fetched with a browser, which is far too
+    heavy to run several of, so they share a single key.
+
+    :param str url: the URL to be fetched
+    :returns: the website key
+    :rtype: str
+    """
+    return "js" if classify_url(url) == "js" else urlparse(url).netloc
+
+
+def _host_lock(url):
+    """Get the lock for the website a URL belongs to.
+
+    :param str url: the URL to be fetched
+    :returns: the lock for the URL's website
+    :rtype: threading.Lock
+    """
+    with _HOST_LOCKS_GUARD:
+        return _HOST_LOCKS.setdefault(_host_key(url), threading.Lock())
+
+
+def _fetch_politely(url, stop, dry_run=False, use_cache=False):
+    """Fetch a URL once its website is free and its politeness wait is over.
+
+    The website's lock is only held for the fetch itself. A worker that
+    has to wait for a website releases the lock and waits on `stop`, so
+    the wait ends early if the caller gives up on the fetches.
 
+    :param str url: the URL to fetch
+    :param threading.Event stop: set when the results are no longer wanted
+    :param bool dry_run: dry run flag
+    :param bool use_cache: use cached URL metadata
+    :return: fetched data, empty if stopped before fetching
+    :rtype: dict(str, str)
+    """
+    key = _host_key(url)
+    lock = _host_lock(url)
+    while not stop.is_set():
+        with lock:
+            delay = _HOST_NEXT_FETCH.get(key, 0) - time.monotonic()
+            if delay <= 0:
+                data, from_cache = cached_call(
+                    f"url:{url}",
+                    functools.partial(fetch_url, url, dry_run=dry_run),
+                    use_cache=use_cache and not dry_run,
+                )
+                # we still want to slow down the crawlers as there may be
+                # several consecutive links to the same website e.g.
+                # youtube. no need to be polite if we never made a request
+                if not dry_run and not from_cache:
+                    wait_time = helpers.wait_time()
+                    logger.info("next request to %s in %ss", key, wait_time)
+                    _HOST_NEXT_FETCH[key] = time.monotonic() + wait_time
+                return data
+
+        stop.wait(delay)
+    return {}
+
+
+def fetch_urls(urls, dry_run=False, use_cache=False):
+    """Fetch several URLs concurrently.
 
-def process(course_data, dry_run=False):
+    URLs are fetched in a thread pool, but results are yielded in the
+    same order as the input so callers can checkpoint their progress.
+    Only a few URLs per worker are queued ahead, if the caller stops or
+    an error is raised the queued fetches are cancelled and any waiting
+    workers give up rather than running through the rest of the URLs.
+
+    :param list urls: the URLs to fetch
+    :param bool dry_run: dry run flag
+    :param bool use_cache: use cached URL metadata
+    :yields dict: fetched data for each URL
+    """
+    workers = _globals.URL_FETCH_WORKERS
+    stop = threading.Event()
+    fetch = functools.partial(
+        _fetch_politely, stop=stop, dry_run=dry_run, use_cache=use_cache)
+    pending = collections.deque()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for url in urls:
+            pending.append(executor.submit(fetch, url))
+            if len(pending) >= workers * QUEUED_FETCHES_PER_WORKER:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    # also covers the generator being closed early and KeyboardInterrupt
+    except BaseException:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+
+
+def process(course_data, dry_run=False, use_cache=False):
     """Process course data.
 
     :param dict course_data: structure containing course information
         to be processed
     :param bool dry_run: dry run flag
+    :param bool use_cache: use cached search results
     :yields dict: processed data for one topic
     """
     for level in course_data["levels"]:
         for module in level["modules"]:
             for topic in module["topics"]:
-                results = set()
-                for page in range(1, pages() + 1):
-                    # fetch
-                    results = fetch_query(topic, results, page, dry_run=dry_run)
-                    if not dry_run:
-                        helpers.wait(end=500)
+                results = fetch_query(
+                    topic,
+                    set(),
+                    pages(),
+                    dry_run=dry_run,
+                    use_cache=use_cache,
+                )
                 # the directory the final resource information will live
                 meta_data = (
                     f"{course_data['course']}/{level['level']}/"
@@ -197,7 +431,7 @@ def process(course_data, dry_run=False):
                     topic.strip(), list(results), meta_data)
 
 
-def course_processor(full_path, dry_run=False):
+def course_processor(full_path, dry_run=False, use_cache=False):
     """Process a course.
 
     Give a JSON file containing course modules and topics to
@@ -205,6 +439,7 @@ def course_processor(full_path, dry_run=False):
 
     :param pathlib.Path full_path: path to file containing course data.
     :param bool dry_run: dry run flag
+    :param bool use_cache: use cached search results
     :returns: 0 if successful - meaning script completed not search
         engines have been crawled successfully
     :rtype: int
@@ -213,7 +448,9 @@ def course_processor(full_path, dry_run=False):
     if not course_data:
         return 1
 
-    for output in process(course_data, dry_run=dry_run):
+    for output in process(
+        course_data, dry_run=dry_run, use_cache=use_cache
+    ):
         if not dry_run:
             # the path in the search dir we want to save the data to
             path_to_search = _globals.SEARCH_RESULT_OUT_FOLDER / full_path.name
@@ -222,7 +459,7 @@ def course_processor(full_path, dry_run=False):
     return 0
 
 
-def search_results_processor(full_path, dry_run=False):
+def search_results_processor(full_path, dry_run=False, use_cache=False):
     """Process search results file.
 
     This parses the output of a crawled search engine. These
@@ -230,6 +467,7 @@ def search_results_processor(full_path, dry_run=False):
 
     :param str full_path: path to file containing the search results
     :param bool dry_run: dry run flag
+    :param bool use_cache: use cached URL metadata
     :return: 0 if successful - meaning the script completed, not that
         all URLs have been successfully fetched
     :rtype: int
@@ -238,6 +476,9 @@ def search_results_processor(full_path, dry_run=False):
     if not search_res:
         return 1
 
+    # the same URL is often found for several queries, keep what has
+    # already been fetched so each URL only goes over the network once
+    fetched = {}
     for query in search_res.keys():
         res_data = search_res[query]
         results = res_data["search-results"]
@@ -251,33 +492,36 @@ def search_results_processor(full_path, dry_run=False):
         full_resource_path = (
             _globals.RESOURCES_OUT_FOLDER / res_data["meta-data"])
         helpers.mkdir(full_resource_path)
-        for index in range(last_dicovered_index + 1, len(results)):
-            # fetch url information
-            data = fetch_url(results[index], dry_run=dry_run)
+        resource_path = (
+            full_resource_path / res_data["query"].strip().replace(" ", "-"))
+        # both files are kept in memory and written out after every URL,
+        # there is no need to read them back from disk each time
+        resources = read_resource_data(resource_path, res_data["query"])
+        pending = results[last_dicovered_index + 1:]
+        # fetch url information, results come back in order
+        fetches = fetch_urls(
+            list(dict.fromkeys(url for url in pending if url not in fetched)),
+            dry_run=dry_run,
+            use_cache=use_cache,
+        )
+        for url in pending:
+            if url not in fetched:
+                fetched[url] = next(fetches)
+            data = fetched[url]
             if data:
                 # incrementally update file in case we crash mid way
-                update_resource_data(
-                    (
-                        full_resource_path
-                        / res_data["query"].strip().replace(" ", "-")
-                    ),
-                    data, res_data["query"]
-                )
+                resources[res_data["query"]].append(data)
+                helpers.write_json(resources, resource_path)
             # increment last discovered and save back to query file
             # in case the program crashes before finishing
             # we want to do this even if there is an error as we will deal
             # with errors later
             res_data["last-discovered"] += 1
-            update_save_json(full_path, res_data)
-
-            # we still want to slow down the crawlers as there may be
-            # several consecutive links to the same website e.g. youtube
-            if not dry_run:
-                helpers.wait()
+            helpers.write_json(search_res, full_path)
     return 0
 
 
-def dispatch(directory, filename=None, dry_run=False):
+def dispatch(directory, filename=None, dry_run=False, use_cache=False):
     """Process a file or directory.
 
     This dispatches either a search engine crawler or a
@@ -286,6 +530,7 @@ def dispatch(directory, filename=None, dry_run=False):
     :param str directory: name of directory to process files from
     :param str filename: a filename to process instead of a while directory
     :param bool dry_run: run tool in dry run mode
+    :param bool use_cache: reuse cached responses from previous runs
 
     :returns: 0 if successful - meaning the script completed, not that
         all URLs have been successfully fetched
@@ -312,13 +557,13 @@ def dispatch(directory, filename=None, dry_run=False):
     if filename:
         logger.info("processing single file %s", filename)
         full_path = dir_path / filename
-        res = func(full_path, dry_run=dry_run)
+        res = func(full_path, dry_run=dry_run, use_cache=use_cache)
 
     else:
         # go through full dir
         for fullpath in process_files(dir_path):
             logger.info("Processing file from dir, filename: %s", fullpath)
-            res = func(fullpath, dry_run=dry_run)
+            res = func(fullpath, dry_run=dry_run, use_cache=use_cache)
             if res != 0:
                 logger.error(
                     "there was an issue processing %s, returning early",
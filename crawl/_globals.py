@@ -1,4 +1,5 @@
 """Global objects for commandline tool."""
+import functools
 import os
 import pathlib
 
@@ -17,14 +18,49 @@ SEARCH_RESULT_OUT_FOLDER = pathlib.Path(
 # for each query we search.
 PAGES = [1, 2, 3]
 
-# init crawler so we can keep using the same session across requests
-CRAWLERS = {
-    "engines": [
-        bing_crawler.BingCrawler(),
-        google_crawler.GoogleCrawler(),
-    ],
-    "web": {
-        "html": html_crawler.HTMLCrawler(),
-        "js": js_crawler.JavascriptCrawler(),
-    }
-}
+# number of URLs fetched at the same time by the web crawlers. requests to
+# the same website are still made one at a time
+URL_FETCH_WORKERS = int(os.environ.get("URL_FETCH_WORKERS", 8))
+
+
+class _Crawlers:
+    """Lazily initialised crawlers.
+
+    Each crawler is only created the first time it is used, so a run that
+    only needs the web crawlers never sets up the search engines and vice
+    versa. Once created the same instance is returned so we can keep using
+    the same session across requests.
+    """
+
+    @functools.cached_property
+    def engines(self):
+        """Search engine crawlers.
+
+        :returns: search engine crawlers
+        :rtype: list[crawler_base.Crawler]
+        """
+        return [
+            bing_crawler.BingCrawler(),
+            google_crawler.GoogleCrawler(),
+        ]
+
+    @functools.cached_property
+    def html(self):
+        """HTML web crawler.
+
+        :returns: HTML crawler
+        :rtype: html_crawler.HTMLCrawler
+        """
+        return html_crawler.HTMLCrawler()
+
+    @functools.cached_property
+    def js(self):
+        """JavaScript web crawler.
+
+        :returns: JavaScript crawler
+        :rtype: js_crawler.JavascriptCrawler
+        """
+        return js_crawler.JavascriptCrawler()
+
+
+CRAWLERS = _Crawlers()
@@ -1,9 +1,14 @@
 # pylint: disable=arguments-differ, no-self-use, consider-using-f-string
 """Crawler for Bing search engine."""
+import functools
 import logging
+import random
 import time
+from urllib.parse import quote_plus
 
 from bs4 import BeautifulSoup
+from lxml import etree
+import lxml.html
 import requests
 
 from sylli_crawl import crawler_base
@@ -26,37 +31,96 @@ HTML_ELEMENT = "li"
 # the element that contains the search results
 SER_CONTAINER_OBJ = "ol"
 
+
+def _has_class(css_class):
+    """XPath predicate matching elements with a given CSS class.
+
+    :param str css_class: the class to match
+    :returns: an XPath predicate expression
+    :rtype: str
+    """
+    return (
+        "contains(concat(' ', normalize-space(@class), ' '), "
+        f"' {css_class} ')"
+    )
+
+
+# compiled once at import, each call walks the tree in C rather than
+# wrapping every node in a python object the way bs4 does
+# search results for all the previously seen classes
+RESULTS_XPATH = etree.XPath(
+    "//{}[@id='{}']//{}[{}]".format(
+        SER_CONTAINER_OBJ,
+        LAST_WORKING_HTML_ID,
+        HTML_ELEMENT,
+        " or ".join(map(_has_class, PREVIOUSLY_SEEN_CSS_CLASSES)),
+    )
+)
+# only the first page has results wrapped in a div with "b_title" class
+B_TITLE_XPATH = etree.XPath(f".//div[{_has_class('b_title')}]")
+H2_XPATH = etree.XPath(".//h2")
+ANCHOR_XPATH = etree.XPath(".//a[@href]")
+# bings "no results" message
+NO_RESULTS_XPATH = etree.XPath(f"//li[{_has_class('b_no')}]//h1")
+
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=4096)
+def _build_url(scheme, netloc, path, query, page):
+    """Build a Bing search url.
+
+    The same query is requested for several pages and is retried on
+    failure, so the formatted urls are cached.
+
+    :param str scheme: url scheme
+    :param str netloc: url network location
+    :param str path: url path
+    :param str query: space separated query
+    :param int page: the page number to request
+    :returns: a fully formed Bing query url
+    :rtype: str
+    """
+    return "{}://{}{}?q={}&first={}".format(
+        scheme,
+        netloc,
+        path,
+        quote_plus(query),
+        (page * 10) - 9,
+    )
+
+
 class BingCrawler(crawler_base.Crawler):
     """Bing crawler object."""
+    __slots__ = ("raw_html", "parsed_html", "dry_run")
+
     def __init__(self):
         super().__init__("https://www.bing.com/search")
         self.headers = self.set_headers()
+        self.raw_html = None
         self.parsed_html = None
         self.dry_run = None
 
-    def _create_bs4_obj(self, raw_html):
-        """Create bs4 object and bind to class property.
+    def _create_tree(self, raw_html):
+        """Create lxml tree and bind to class property.
 
         :param bytes raw_html: html from response object
         :return: parsed html
-        :rtype: bs4.BeautifulSoup
+        :rtype: lxml.html.HtmlElement
         """
-        self.parsed_html = BeautifulSoup(raw_html, 'lxml')
+        self.raw_html = raw_html
+        self.parsed_html = lxml.html.fromstring(raw_html)
         return self.parsed_html
 
-    def _handle_parse_error(self, bs4_obj):
+    def _handle_parse_error(self, tree):
         """Handle errors parsing SERP.
 
-        :param bs4.BeautifulSoup bs4_obj: parsed HTML page
+        :param lxml.html.HtmlElement tree: parsed HTML page
         :raises errors.ParseError: when no CSS match is found
         """
-        err_container = bs4_obj.find(
-            "li", attrs={"class": "b_no"})
-        if err_container and err_container.find("h1"):
-            err_msg = err_container.find("h1").text
+        err_headers = NO_RESULTS_XPATH(tree)
+        if err_headers:
+            err_msg = err_headers[0].text_content()
             logger.error(err_msg)
         else:
             err_msg = (
@@ -88,21 +152,33 @@ class BingCrawler(crawler_base.Crawler):
         # backoff mechanism while we wait for a result
         attempts = 1
         next_wait_time = 1
-        while next_wait_time < max_wait and attempts <= retries:
+        while attempts <= retries:
             resp = self._request("get", full_url, headers=self.headers)
             # parse page
-            parsed_html = self._create_bs4_obj(resp.text)
-            out_arr = self.parse_page(parsed_html)
-
-            if out_arr:
+            try:
+                parsed_html = self._create_tree(resp.content)
+            except etree.ParserError as e:
+                # lxml cant build a tree from an empty page, treat it the
+                # same as a page with no results
+                logger.error(e)
+                out_arr = []
+            else:
+                out_arr = self.parse_page(parsed_html)
+
+            # no point waiting if we are not going to try again
+            if out_arr or attempts == retries:
                 break
 
-            # backoff
+            # backoff, with jitter so retries dont fall into lock step with
+            # any other requests being made at the same time. the cap goes
+            # on after the jitter so no single wait is longer than max_wait
+            sleep_time = min(
+                next_wait_time * random.uniform(0.5, 1.5), max_wait)
             logger.info(
                 "Did not get any results after %s attempts, sleeping for %s",
-                attempts, next_wait_time
+                attempts, sleep_time
             )
-            time.sleep(next_wait_time)
+            time.sleep(sleep_time)
             attempts += 1
             next_wait_time *= backoff
 
@@ -129,60 +205,42 @@ class BingCrawler(crawler_base.Crawler):
         """
         if page < 1:
             raise ValueError("Pages must be 1 or higher")
-        full_url = "{}://{}{}?q={}&first={}".format(
-            self.scheme,
-            self.netloc,
-            self.path,
-            "+".join(query.split(" ")),
-            (page * 10) - 9,
-        )
-        return full_url
-
-    def parse_page(self, bs4_obj):
+        return _build_url(self.scheme, self.netloc, self.path, query, page)
+
+    def parse_page(self, tree):
         """Parse a Bing SERP.
 
-        :param bs4.BeautifulSoup bs4_obj: parsed html
+        :param lxml.html.HtmlElement tree: parsed html
         :returns: array of links from Bing SERP
         :rtype: list[str]
         :raises errors.ParseError: when no css classes are matched
         """
         # all bing results are in a "results" ol element container
-        ol_container = bs4_obj.find(
-            f"{SER_CONTAINER_OBJ}", attrs={"id": f"{LAST_WORKING_HTML_ID}"})
-        # narrow down our search for the actual SERP results
-        search_res = None
-        for css_class in PREVIOUSLY_SEEN_CSS_CLASSES:
-            search_res = ol_container.find_all(
-                f"{HTML_ELEMENT}", attrs={"class": f"{css_class}"})
-            if search_res:
-                logger.info("Found matching CSS class: %s", css_class)
-                break
+        search_res = RESULTS_XPATH(tree)
 
         if not search_res:
             try:
-                self._handle_parse_error(bs4_obj)
+                self._handle_parse_error(tree)
             except errors.ParseError as err:
                 logger.error(err)
                 return None
 
         out_arr = []
         for res in search_res:
-            title = res.find("div", attrs={"class": "b_title"})
+            title = B_TITLE_XPATH(res) or H2_XPATH(res)
             if not title:
-                # only the first page has results wrapped in a div
-                # with "b_title" class
-                title = res.find("h2")
+                continue
 
             # on firefox bing uses a redirect and the real url is
             # available under `hover-url`, we can search for `href` when
             # using chrome headers
-            anchor = title.select_one("a[href]")
-            if anchor is not None:
-                out_arr.append(anchor["href"])
+            anchor = ANCHOR_XPATH(title[0])
+            if anchor:
+                out_arr.append(anchor[0].get("href"))
 
         # this means there was some kind of error
         if not out_arr:
-            self._handle_parse_error(bs4_obj)
+            self._handle_parse_error(tree)
 
         return out_arr
 
@@ -218,5 +276,7 @@ class BingCrawler(crawler_base.Crawler):
                 "No search results matching query, dumping HTML. "
                 "Query: %s", query
             )
-            helpers.dump_pretty_html(self.parsed_html, "bing")
+            # bs4 is only needed to pretty print the page for debugging
+            helpers.dump_pretty_html(
+                BeautifulSoup(self.raw_html, "lxml"), "bing")
         return out
@@ -1,15 +1,37 @@
 """Base module for crawlers."""
 from urllib.parse import urlparse
 
-import requests
+from sylli_crawl.utils import sessions
+
+# (connect, read) timeouts in seconds. a host that will not accept a
+# connection is given up on quickly so it does not hold up the crawl
+DEFAULT_TIMEOUT = (3.05, 5)
 
 
 class Crawler:
     """Base class for all crawlers."""
-    def __init__(self, full_url=None):
+    # no per-instance __dict__, subclasses list their own attributes
+    __slots__ = (
+        "full_url",
+        "scheme",
+        "netloc",
+        "path",
+        "params",
+        "query",
+        "fragment",
+        "is_js",
+        "is_pdf",
+        "is_html",
+        "headers",
+        "session",
+    )
+
+    def __init__(self, full_url=None, session=None):
         """Crawler init
 
         :param str full_url: a url this crawler will function on
+        :param requests.Session session: session to make requests with,
+            defaults to the session shared by all crawlers
         """
         self.full_url = full_url
 
@@ -33,8 +55,8 @@ class Crawler:
         if self.full_url:
             self._url_parse(self.full_url)
 
-        # session
-        self.session = requests.Session()
+        # session, shared so connections are pooled across crawlers
+        self.session = session or sessions.SESSION
 
     def _url_parse(self, url):
         """Thin wrapper around urlparse
@@ -50,8 +72,7 @@ class Crawler:
         self.query = parsed_url.query
         self.fragment = parsed_url.fragment
 
-    # pylint: disable=unused-argument
-    def _request(self, method, full_url, timeout=1, **kwargs):
+    def _request(self, method, full_url, timeout=DEFAULT_TIMEOUT, **kwargs):
         """Think wrapper around a requests session.
 
         This will be used for the duration of the program by each
@@ -59,7 +80,9 @@ class Crawler:
 
         :param str method: http method (normal CRUD)
         :param str full_url: the full url to request
-        :param int timeout: length of time before requests time out
+        :param float|tuple timeout: seconds before requests time out,
+            either one value or a (connect, read) tuple. crawlers going
+            through many hosts may want a lower read timeout
         :param dict kwargs: other optional params for request.session
         :return: a response object
         :rtype: request.Response
@@ -67,7 +90,7 @@ class Crawler:
         resp = self.session.request(
             method,
             full_url,
-            timeout=5,
+            timeout=timeout,
             **kwargs,
         )
         resp.raise_for_status()
@@ -1,17 +1,40 @@
-# pylint: disable=arguments-differ, no-self-use, consider-using-f-string
+# pylint: disable=arguments-differ, no-self-use
 """Crawler for Google search engine."""
 import logging
 import re
 import time
+from urllib.parse import urlencode
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import requests
+import soupsieve
 
 from sylli_crawl import crawler_base
 from sylli_crawl.utils import errors, headers, helpers
 
 # variable name to look for in script tag in consent modal
 CONSENT_VAR_NAME = "rAU"
+CONSENT_RE = re.compile(rf"{CONSENT_VAR_NAME}=([^;]+)")
+# the consent url is embedded in a script with = and & hex escaped
+HEX_ESCAPE_RE = re.compile(r"\\x([0-9a-fA-F]{2})")
+# query params for the consent url, in order. params without a value
+# have to be pulled out of the consent script
+CONSENT_TOKENS = (
+    ("continue", None),
+    ("gl", "GB"),
+    ("m", "0"),
+    ("pc", "srp"),
+    ("x", "5"),
+    ("src", "2"),
+    ("hl", "en"),
+    ("bl", None),
+    ("uxe", "none"),
+    ("set_eom", "true"),
+)
+CONSENT_TOKEN_RES = {
+    token: re.compile(rf"{token}=([^&]+)")
+    for token, value in CONSENT_TOKENS if value is None
+}
 # currently working css class to search for
 LAST_WORKING_CSS_CLASS = "yuRUbf"
 
@@ -21,6 +44,8 @@ LAST_WORKING_CSS_CLASS = "yuRUbf"
 # NOTE 2: css classes google uses seem to be dependant on location
 # and js status
 PREVIOUSLY_SEEN_CSS_CLASSES = [LAST_WORKING_CSS_CLASS, "g", "kCrYT"]
+# for membership checks while walking the page
+SEARCH_RESULT_CSS_CLASSES = frozenset(PREVIOUSLY_SEEN_CSS_CLASSES)
 
 # the html element to search for
 HTML_ELEMENT = "div"
@@ -28,12 +53,23 @@ HTML_ELEMENT = "div"
 # tag for video area on SREP
 VIDEO_ELEMENT_TAG = "video-voyager"
 
+# links inside search results and videos, compiled once rather than on
+# every lookup
+RESULT_LINK_SELECTOR = soupsieve.compile("a")
+VIDEO_LINK_SELECTOR = soupsieve.compile("a[href]")
+
+# only the tags parse_page looks at (results, consent modal and its
+# script, videos) are built into the tree, the rest of the page is skipped
+PARSE_ONLY = SoupStrainer([HTML_ELEMENT, "script", VIDEO_ELEMENT_TAG])
+
 logger = logging.getLogger(__name__)
 # logger.info("goog logger set")
 
 
 class GoogleCrawler(crawler_base.Crawler):
     """Google crawler object."""
+    __slots__ = ("parsed_html", "consent_url", "dry_run")
+
     def __init__(self):
         super().__init__("https://www.google.com/search")
         self.headers = self.set_headers()
@@ -58,22 +94,14 @@ class GoogleCrawler(crawler_base.Crawler):
         :returns: a cleaned url
         :rtype: str
         """
-        out = []
-        char = 0
         # some of googles search results start with /url?=
-        while url[char] != "h":
-            char += 1
-        # add url to out until we see an & because we dont care
+        start = url.find("h")
+        if start == -1:
+            return url
+        # cut the url at the first & because we dont care
         # about extra query params, we just want the full
         # clean url
-        while char < len(url):
-            if url[char] == "&":
-                break
-
-            out.append(url[char])
-            char += 1
-
-        return "".join(out)
+        return url[start:].split("&", 1)[0]
 
     def _build_consent_url(self, s):
         """Construct url for consent form.
@@ -82,27 +110,13 @@ class GoogleCrawler(crawler_base.Crawler):
         :returns: a correctly formatted consent url
         :rtype: str
         """
-        tokens = {
-            "continue": None,
-            "gl": "GB",
-            "m": "0",
-            "pc": "srp",
-            "x": "5",
-            "src": "2",
-            "hl": "en",
-            "bl": None,
-            "uxe": "none",
-            "set_eom": "true",
-        }
-
         out = []
-        for k, v in tokens.items():
+        for k, v in CONSENT_TOKENS:
             if v:
                 out.append(f"{k}={v}")
                 continue
 
-            pat = f"{k}=([^&]+)"
-            match = re.search(pat, s)
+            match = CONSENT_TOKEN_RES[k].search(s)
             if match:
                 out.append(match.group())
 
@@ -122,29 +136,34 @@ class GoogleCrawler(crawler_base.Crawler):
         # the-ultimate-guide-to-the-google-search-parameters
         if page < 1:
             raise ValueError("Pages must be 1 or higher")
-        full_url = "{}://{}{}?q={}&start={}&safe=strict&ie=UTF-8".format(
-            self.scheme,
-            self.netloc,
-            self.path,
-            "+".join(query.split(" ")),
-            (page - 1) * 10,
-        )
-        return full_url
-
-    def _consent(self, parsed_html):
+        # urlencode escapes the query properly e.g. "c++" or "a & b"
+        params = urlencode({
+            "q": query,
+            "start": (page - 1) * 10,
+            "safe": "strict",
+            "ie": "UTF-8",
+        })
+        return f"{self.full_url}?{params}"
+
+    def _consent(self, parsed_html, scripts=None):
         """Navigate Google consent modal.
 
         :param bs4.BeautifulSoup parsed_html: parsed_html
+        :param list[bs4.element.Tag] scripts: script tags on the page if
+            already found, saves searching the page again
         :raises errors.ConsentParseError: when failure during
             consent navigation occurs
         """
 
         # find url string
-        pattern = f"{CONSENT_VAR_NAME}=([^;]+)"
-        script = parsed_html.find_all("script")
+        if scripts is None:
+            scripts = parsed_html.find_all("script")
         s = None
-        for i in script:
-            f = re.search(pattern, i.string)
+        for i in scripts:
+            # external scripts have no body to search
+            if i.string is None:
+                continue
+            f = CONSENT_RE.search(i.string)
             if f:
                 s = f.group()[5:-1]
                 break
@@ -153,31 +172,8 @@ class GoogleCrawler(crawler_base.Crawler):
             raise errors.ConsentParseError(
                 f"no match found for {CONSENT_VAR_NAME}")
 
-        # clean string and remove badly encoded chars
-        out = []
-        char = 0
-        while char < len(s):
-            if s[char] == "\\":
-                t = ''
-                i = 0
-                while i < 4:
-                    t += s[char]
-                    char += 1
-                    i += 1
-                # replace hex encoded chars with unicode
-                if t == r"\x3d":
-                    out.append("=")
-                elif t == r"\x26":
-                    out.append("&")
-                else:
-                    logger.warning(
-                        "unrecognised encoded character: %s", t)
-
-            out.append(s[char])
-
-            char += 1
-
-        m = "".join(out)
+        # clean string, replace hex encoded chars with unicode
+        m = HEX_ESCAPE_RE.sub(lambda e: chr(int(e.group(1), 16)), s)
         url = f"{self.consent_url}?{self._build_consent_url(m)}"
         # send post request to pass consent page
         logger.info("consent url: %s", url)
@@ -200,7 +196,8 @@ class GoogleCrawler(crawler_base.Crawler):
         :return: parsed html
         :rtype: bs4.BeautifulSoup
         """
-        self.parsed_html = BeautifulSoup(raw_html, 'lxml')
+        self.parsed_html = BeautifulSoup(
+            raw_html, 'lxml', parse_only=PARSE_ONLY)
         return self.parsed_html
 
     def has_modal(self, bs4_obj):
@@ -211,23 +208,59 @@ class GoogleCrawler(crawler_base.Crawler):
         :return: true is there is a modal else false
         :rtype: bool
         """
-        modal = bs4_obj.find_all("div", attrs={"aria-modal": "true"})
-        return modal != []
+        # we only care whether there is one, stop at the first match
+        modal = bs4_obj.find("div", attrs={"aria-modal": "true"})
+        return modal is not None
 
-    def parse_video(self, bs4_obj):
-        """Get any video links on the Page.
+    def _harvest(self, bs4_obj):
+        """Collect every element parse_page needs in one walk of the page.
 
-        :param bs4.BeautifulSoup bs4_obj: parsed html page
+        :param bs4.BeautifulSoup bs4_obj: parsed html
+        :returns: the consent modal (or None), script tags, search result
+            containers and video containers, in document order
+        :rtype: dict
+        """
+        found = {"modal": None, "scripts": [], "results": [], "videos": []}
+        for tag in bs4_obj.descendants:
+            if not isinstance(tag, Tag):
+                continue
+
+            if tag.name == "script":
+                found["scripts"].append(tag)
+            elif tag.name == VIDEO_ELEMENT_TAG:
+                found["videos"].append(tag)
+            elif tag.name == HTML_ELEMENT:
+                if found["modal"] is None and tag.get("aria-modal") == "true":
+                    found["modal"] = tag
+                if SEARCH_RESULT_CSS_CLASSES.intersection(
+                    tag.get("class", ())
+                ):
+                    found["results"].append(tag)
+        return found
+
+    def _video_links(self, videos):
+        """Get the link from each video container.
+
+        :param list[bs4.element.Tag] videos: video containers
         :returns: a list of video links
         :rtype: list[str]
         """
         out = []
-        for video in bs4_obj.find_all(VIDEO_ELEMENT_TAG):
-            anchor = video.select_one("a[href]")
+        for video in videos:
+            anchor = VIDEO_LINK_SELECTOR.select_one(video)
             if anchor:
                 out.append(anchor["href"])
         return out
 
+    def parse_video(self, bs4_obj):
+        """Get any video links on the Page.
+
+        :param bs4.BeautifulSoup bs4_obj: parsed html page
+        :returns: a list of video links
+        :rtype: list[str]
+        """
+        return self._video_links(bs4_obj.find_all(VIDEO_ELEMENT_TAG))
+
     def parse_page(self, bs4_obj):
         """Parse a Google SERP.
 
@@ -236,19 +269,22 @@ class GoogleCrawler(crawler_base.Crawler):
         :rtype: list[str]
         :raises errors.ParseError: when no css classes are matched
         """
-        if self.has_modal(bs4_obj):
+        # walk the page once and pick out everything we need
+        found = self._harvest(bs4_obj)
+        if found["modal"] is not None:
             wait_time = 5
             logger.warning(
                 "Page has consent modal. Waiting %ss before making request",
                 wait_time
             )
             time.sleep(wait_time)
-            self._consent(bs4_obj)
+            self._consent(bs4_obj, scripts=found["scripts"])
 
+        # use the matches for the first class in the list that was found
         search_res = None
         for css_class in PREVIOUSLY_SEEN_CSS_CLASSES:
-            search_res = bs4_obj.find_all(
-                f"{HTML_ELEMENT}", attrs={"class": f"{css_class}"})
+            search_res = [
+                res for res in found["results"] if css_class in res["class"]]
             if search_res:
                 logger.info("Found matching CSS class: %s", css_class)
                 break
@@ -260,11 +296,11 @@ class GoogleCrawler(crawler_base.Crawler):
 
         out_arr = []
         for res in search_res:
-            anchor = res.select_one("a")
+            anchor = RESULT_LINK_SELECTOR.select_one(res)
             if anchor is not None:
                 out_arr.append(self._clean_url(anchor["href"]))
         # add any videos found to the current output
-        out_arr += self.parse_video(bs4_obj)
+        out_arr += self._video_links(found["videos"])
         return out_arr
 
     def fetch(self, query, page=1, dry_run=False):
@@ -303,11 +339,13 @@ class GoogleCrawler(crawler_base.Crawler):
                 logger.warning("redirected to consent page.")
 
             try:
-                bs4_obj = self._create_bs4_obj(resp.text)
+                bs4_obj = self._create_bs4_obj(resp.content)
                 out_arr = self.parse_page(bs4_obj)
 
             except (errors.ConsentParseError, errors.ParseError) as err:
                 logger.error("could not parse page, dumping HTML: %s", err)
-                helpers.dump_pretty_html(self.parsed_html, "google")
+                # the parsed tree only has some of the page, dump all of it
+                helpers.dump_pretty_html(
+                    BeautifulSoup(resp.content, 'lxml'), "google")
 
         return out_arr
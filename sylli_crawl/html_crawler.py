@@ -1,36 +1,54 @@
 # pylint: disable=abstract-method, arguments-differ, no-self-use
 """Crawl a HTML site"""
 import logging
+from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
+from lxml import etree
 import requests
 
 from sylli_crawl import crawler_base
-from sylli_crawl.utils import headers, helpers
+from sylli_crawl.utils import helpers
 
 logger = logging.getLogger(__name__)
 
+# bytes read from the network at a time while looking for the title
+CHUNK_SIZE = 16 * 1024
+
 
 class HTMLCrawler(crawler_base.Crawler):
     """HTML Crawler."""
-    def __init__(self):
-        # init parent class to get access to class properties
-        super().__init__()
-        self.headers = headers.firefox_headers()
+    __slots__ = ()
 
-    def parse_page(self, raw_html):
+    def parse_page(self, chunks, encoding=None):
         """Parse the page HTML.
 
-        :returns: page title
+        The page is parsed as it arrives and reading stops as soon as the
+        title has been seen, the rest of the page is never downloaded.
+
+        :param iterable[bytes] chunks: raw html from the network response
+        :param str encoding: charset sent by the server, when None the
+            parser looks for a meta charset in the page itself
+        :returns: page title or None if the page has no title
         :rtype: str
         """
-        bs4_obj = BeautifulSoup(raw_html, 'lxml')
-        title = bs4_obj.find('title').text
-        return title
+        parser = etree.HTMLPullParser(
+            events=("end",), tag="title", encoding=encoding)
+        for chunk in chunks:
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                return "".join(element.itertext())
+
+        parser.close()
+        for _, element in parser.read_events():
+            return "".join(element.itertext())
+        return None
 
     def fetch(self, url, dry_run=False):
         """Fetch a given URL.
 
+        This may be called from several threads at once so nothing about
+        the url is stored on the crawler.
+
         :param str url: the url to fetch
         :param bool dry_run: dry run flag
         :return: metadata for url
@@ -39,9 +57,7 @@ class HTMLCrawler(crawler_base.Crawler):
         metadata = {}
         resp = None
         # each new url needs to be parsed separately
-        self._url_parse(url)
-        # set custom host for each url
-        self.headers["Host"] = self.netloc
+        netloc = urlparse(url).netloc
 
         logger.info("fetching: %s", url)
 
@@ -50,19 +66,29 @@ class HTMLCrawler(crawler_base.Crawler):
             return metadata
 
         try:
-            resp = self._request("get", url, headers=self.headers)
+            # headers are the session defaults, requests sets the host.
+            # the body is streamed so we can stop once we have the title
+            resp = self._request("get", url, stream=True)
+            # requests falls back to latin-1 for text pages with no
+            # charset, only trust the encoding if the server sent one
+            content_type = resp.headers.get("content-type", "").lower()
+            encoding = resp.encoding if "charset" in content_type else None
+            with resp:
+                title = self.parse_page(
+                    resp.iter_content(CHUNK_SIZE), encoding=encoding)
 
-        except requests.exceptions.RequestException as e:
+        # an empty body makes the parser raise when it is closed
+        except (requests.exceptions.RequestException, etree.LxmlError) as e:
             logger.error(e)
             helpers.write_error_urls(url)
+            resp = None
 
         if resp:
-            title = self.parse_page(resp.text)
             # add metadata
             metadata["url"] = url
             metadata["title"] = title
-            metadata["author"] = self.netloc
+            metadata["author"] = netloc
             metadata["type"] = "A"
-            metadata["source"] = self.netloc
+            metadata["source"] = netloc
 
         return metadata
@@ -1,14 +1,18 @@
 # pylint: disable=abstract-method, arguments-differ, no-self-use
 # pylint: disable=arguments-renamed
 """Crawl a JavaScript sites"""
+import functools
 import logging
-import pickle
 import time
+from urllib.parse import urlparse
+import weakref
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 from selenium.common.exceptions import (
     NoSuchElementException, WebDriverException)
 from selenium.webdriver.common.by import By
+import soupsieve
 
 from sylli_crawl import crawler_base
 from sylli_crawl.utils import driver_manager, errors, helpers
@@ -19,16 +23,58 @@ REJECT_ALL_XPATH = '//ytd-button-renderer[contains(., "Reject all")]'
 # youtube tags and class for channel name
 CHANNEL_NAME_TAG = "yt-formatted-string"
 YT_CHANNEL_CLASS_NAMES = "style-scope ytd-channel-name"
+# selectors are compiled once rather than on every lookup
+CHANNEL_LINK_SELECTOR = soupsieve.compile("a")
+# the channel link is one of the last things rendered on a video page
+YT_READY_LOCATOR = (By.CSS_SELECTOR, "yt-formatted-string.ytd-channel-name a")
+# a small page on the youtube domain, cookies can only be added to the
+# domain the browser is currently on
+YT_COOKIE_DOMAIN_URL = "https://www.youtube.com/robots.txt"
+# the consent form stops the rest of the page rendering
+YT_CONSENT_LOCATOR = (By.CSS_SELECTOR, "tp-yt-paper-dialog#dialog")
+# some of the video metadata is lazy loaded after the page is ready
+YT_SETTLE_SECS = 1
+
+# khan academy pages are titled "Khan Academy" until the page has rendered
+KHAN_PLACEHOLDER_TITLE = "Khan Academy"
 
 # youtube tags and class for video title
 VIDEO_TITLE_ELEMENT = "h1"
 VIDEO_TITLE_CLASS_NAMES = "title style-scope ytd-video-primary-info-renderer"
+VIDEO_TITLE_TEXT_SELECTOR = soupsieve.compile("yt-formatted-string")
+
+# only the tags we read are built into the tree, the rest is skipped.
+# youtube needs the video title and channel name, the consent modal and
+# the CAPTCHA markers, khan only needs the page title
+YT_PARSE_ONLY = SoupStrainer([
+    "title",
+    VIDEO_TITLE_ELEMENT,
+    CHANNEL_NAME_TAG,
+    "form",
+    "div",
+    "tp-yt-paper-dialog",
+])
+KHAN_PARSE_ONLY = SoupStrainer("title")
+
+# tags the streaming youtube parser stops on and characters fed at a time
+YT_STREAM_TAGS = (
+    VIDEO_TITLE_ELEMENT, CHANNEL_NAME_TAG, "form", "div", "tp-yt-paper-dialog")
+YT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# JavascriptCrawler attribute of the crawler for each site. subdomains
+# e.g. www. are looked up without their first label
+SITE_CRAWLERS = {
+    "khanacademy.org": "khan_crawler",
+    "youtube.com": "yt_crawler",
+}
 
 logger = logging.getLogger(__name__)
 
 
 class KhanAcademyCralwer(crawler_base.Crawler):
     """Khan Academy Crawler."""
+    __slots__ = ("headless",)
+
     def __init__(self, headless=True):
         super().__init__()
         # useful for debugging
@@ -38,14 +84,18 @@ class KhanAcademyCralwer(crawler_base.Crawler):
         """Request a given URL.
 
         :param str full_url: the url to request
-        :param int sleep_secs: seconds to wait for browser to load
+        :param int sleep_secs: max seconds to wait for browser to load
         :returns: parse page source
         :rtype: bs4.BeautifulSoup
         """
         page_source = None
         with driver_manager.get_driver(headless=self.headless) as driver:
             driver.get(full_url)
-            time.sleep(sleep_secs)
+            driver_manager.wait_until(
+                driver,
+                lambda d: d.title not in ("", KHAN_PLACEHOLDER_TITLE),
+                sleep_secs,
+            )
             page_source = driver.page_source
 
         return page_source
@@ -57,7 +107,7 @@ class KhanAcademyCralwer(crawler_base.Crawler):
         :returns: page title
         :rtype: str
         """
-        bs4_obj = BeautifulSoup(raw_html, 'lxml')
+        bs4_obj = BeautifulSoup(raw_html, 'lxml', parse_only=KHAN_PARSE_ONLY)
         title = bs4_obj.find('title').text
         return title
 
@@ -108,6 +158,15 @@ class KhanAcademyCralwer(crawler_base.Crawler):
 
 class YoutubeCrawler(crawler_base.Crawler):
     """Youtube Crawler."""
+    __slots__ = (
+        "consent_passed",
+        "cookies",
+        "cookie_file",
+        "cookie_file_exists",
+        "headless",
+        "primed_drivers",
+    )
+
     # how to reuse session:
     # https://stackoverflow.com/questions/49764902/how-to-reuse-a-selenium-browser-session
     # https://dev.to/hardiksondagar/reuse-sessions-using-cookies-in-python-selenium-12ca
@@ -116,58 +175,83 @@ class YoutubeCrawler(crawler_base.Crawler):
     def __init__(self, headless=True):
         super().__init__()
         self.consent_passed = False
-        self.cookie_file = helpers.COOKIE_PATH / "youtube-cookie.pkl"
-        self.cookie_file_exists = False
-        # make parsed html (bs4 object) accessible class wide
-        self.parsed_html = None
+        self.cookie_file = helpers.COOKIE_PATH / "youtube-cookie.json"
+        # an old pickled cookie file is converted when it is first read
+        self.cookie_file_exists = (
+            self.cookie_file.exists()
+            or self.cookie_file.with_suffix(".pkl").exists()
+        )
+        # saved cookies, read from the cookie file the first time needed
+        self.cookies = None
         # useful for debugging
         self.headless = headless
+        # drivers are reused and keep their cookies between requests, so
+        # saved cookies only need loading into each driver once
+        self.primed_drivers = weakref.WeakSet()
 
     def _request(self, full_url, sleep_secs=10, check_consent=False):
         """Request a given URL.
 
         :param str full_url: the url to request
-        :param int sleep_secs: seconds to wait for browser to load
+        :param int sleep_secs: max seconds to wait for browser to load
         :param bool check_constant: check consent form flag
-        :returns: parse page source
-        :rtype: bs4.BeautifulSoup
+        :returns: the fields read from the page, see `page_fields`
+        :rtype: dict
         """
         with driver_manager.get_driver(headless=self.headless) as driver:
-            driver.get(full_url)
-
-            # optimistically try load cookies
-            self.load_cookies(driver)
-            time.sleep(sleep_secs)
+            # optimistically try load cookies. they go in before the
+            # real page is requested so it doesnt need loading twice
+            if driver not in self.primed_drivers:
+                if self.cookie_file_exists:
+                    driver.get(YT_COOKIE_DOMAIN_URL)
+                    self.load_cookies(driver)
+                self.primed_drivers.add(driver)
 
+            driver.get(full_url)
+            # stop waiting as soon as the page is ready or we know
+            # there is a consent form to deal with
+            if driver_manager.wait_until(
+                driver,
+                driver_manager.any_element_present(
+                    YT_READY_LOCATOR, YT_CONSENT_LOCATOR),
+                sleep_secs,
+            ):
+                time.sleep(YT_SETTLE_SECS)
+
+            # page_source is a round trip to the browser, only ask once
+            page_source = driver.page_source
             # check if there is source code from driver
             # this can cause unexpected errors
-            if not driver.page_source:
+            if not page_source:
                 logger.error("unable to return source from driver")
                 raise errors.SourceError
 
-            # we need to parse the page in here so we can check for
+            # we need to read the page in here so we can check for
             # as consent modal on the page and then reuse the driver
-            # to get past it and save the cookies
-            self.parsed_html = self.parse_page(driver.page_source)
+            # to get past it and save the cookies. this is the only
+            # parse, the caller gets the same fields
+            fields = self.page_fields(
+                page_source, find_modal=not check_consent)
 
-            if not check_consent and self.has_modal(self.parsed_html):
+            if not check_consent and fields["modal"]:
                 logger.warning("Page may have a consent form")
                 self.consent(driver)
 
             # will only save cookies if not already saved
             self.save_cookies(driver)
 
-        return self.parsed_html
+        return fields
 
     def save_cookies(self, driver):
-        """Pickle and save browser cookies.
+        """Save browser cookies as JSON.
 
         :param selenium.webdriver driver: the browser driver
         """
-        if not self.cookie_file.exists():
-            with open(self.cookie_file, "wb") as fd:
-                pickle.dump(driver.get_cookies(), fd)
-            logger.info("loaded saved cookies")
+        if not self.cookie_file_exists:
+            self.cookies = driver.get_cookies()
+            helpers.write_json(self.cookies, self.cookie_file)
+            self.cookie_file_exists = True
+            logger.info("saved cookies")
 
     def load_cookies(self, driver):
         """Load saved cookies.
@@ -175,14 +259,13 @@ class YoutubeCrawler(crawler_base.Crawler):
         :param selenium.webdriver driver: the browser driver
         """
         logger.info("loading cookies...")
-        if self.cookie_file.exists():
-            with open(self.cookie_file, "rb") as fd:
-                content = pickle.load(fd)
-                for cookie in content:
-                    driver.add_cookie(cookie)
-            # test if this is needed
-            driver.refresh()
-            logger.info("refreshed browser")
+        if self.cookies is None:
+            self.cookies = helpers.read_cookies(self.cookie_file)
+
+        if self.cookies is not None:
+            for cookie in self.cookies:
+                driver.add_cookie(cookie)
+            logger.info("loaded saved cookies")
 
     def consent(self, driver):
         """Navigate youtube consent form.
@@ -215,16 +298,19 @@ class YoutubeCrawler(crawler_base.Crawler):
         :returns: true if page has CAPTCHA
         :rtype: bool
         """
+        # each check stops at the first match and we return as soon as
+        # one of them finds something
         # in the example html file there is a form object which contains
         # the CAPTCHA challenge
-        captcha_form = bs4_obj.find_all("form", attrs={"id": "captcha-form"})
+        if bs4_obj.find("form", attrs={"id": "captcha-form"}) is not None:
+            return True
         # this is the div that contains the actual iframe within which the
         # CAPTCHA challenge sits
-        captcha_div = bs4_obj.find_all("div", attrs={"class": "g-recaptcha"})
+        if bs4_obj.find("div", attrs={"class": "g-recaptcha"}) is not None:
+            return True
         # the div that contains the human readable text tell you to complete it
         info_div = bs4_obj.find("div", attrs={"id": "infoDiv"})
-        info_contains = "CAPTCHA" in info_div.text if info_div else False
-        return captcha_form != [] or captcha_div != [] or info_contains
+        return "CAPTCHA" in info_div.text if info_div else False
 
     def has_modal(self, bs4_obj):
         """Check if page has modal.
@@ -235,8 +321,9 @@ class YoutubeCrawler(crawler_base.Crawler):
         :return: true if modal found
         :rtype: bool
         """
-        modal = bs4_obj.find_all("tp-yt-paper-dialog", attrs={"id": "dialog"})
-        return modal != []
+        # we only care whether there is one, stop at the first match
+        modal = bs4_obj.find("tp-yt-paper-dialog", attrs={"id": "dialog"})
+        return modal is not None
 
     def _channel_name(self, bs4_obj):
         """Get youtube channel name.
@@ -248,7 +335,7 @@ class YoutubeCrawler(crawler_base.Crawler):
         container = bs4_obj.find(
             CHANNEL_NAME_TAG, attrs={"class": YT_CHANNEL_CLASS_NAMES}
         )
-        channel_name = container.select_one("a").text
+        channel_name = CHANNEL_LINK_SELECTOR.select_one(container).text
         logger.info(
             "found youtube channel name: %s",
             channel_name
@@ -265,7 +352,7 @@ class YoutubeCrawler(crawler_base.Crawler):
         container = bs4_obj.find(
             VIDEO_TITLE_ELEMENT, attrs={"class": VIDEO_TITLE_CLASS_NAMES}
         )
-        video_title = container.select_one("yt-formatted-string").text
+        video_title = VIDEO_TITLE_TEXT_SELECTOR.select_one(container).text
         logger.info(
             "found youtube video title: %s",
             video_title
@@ -279,9 +366,114 @@ class YoutubeCrawler(crawler_base.Crawler):
         :return: parsed html
         :rtype: bs4.BeautifulSoup
         """
-        bs4_obj = BeautifulSoup(raw_html, 'lxml')
+        bs4_obj = BeautifulSoup(raw_html, 'lxml', parse_only=YT_PARSE_ONLY)
         return bs4_obj
 
+    def _stream_fields(self, raw_html, find_modal=True):
+        """Read the fields we need from the page as it is parsed.
+
+        Parsing stops as soon as everything has been found, so the rest
+        of the page is never parsed. The consent modal is near the end of
+        the page so when we dont need to know about it we can usually stop
+        well before the end. lxml still builds the tree for the part of
+        the page that is parsed, elements are not cleared as an outer div
+        or title may still need the text of the ones inside it.
+
+        :param str raw_html: page source from the driver
+        :param bool find_modal: whether to look for the consent modal
+        :returns: the fields read from the page, see `page_fields`
+        :rtype: dict
+        :raises lxml.etree.LxmlError: when the page cannot be parsed
+        """
+        fields = {"title": None, "channel": None, "modal": False,
+                  "captcha": False}
+        parser = etree.HTMLPullParser(events=("end",), tag=YT_STREAM_TAGS)
+
+        def read(events):
+            for _, element in events:
+                tag = element.tag
+                if tag == VIDEO_TITLE_ELEMENT:
+                    if fields["title"] is None and (
+                        element.get("class") == VIDEO_TITLE_CLASS_NAMES
+                    ):
+                        title = element.find(".//yt-formatted-string")
+                        if title is not None:
+                            fields["title"] = "".join(title.itertext())
+                elif tag == CHANNEL_NAME_TAG:
+                    if fields["channel"] is None and (
+                        element.get("class") == YT_CHANNEL_CLASS_NAMES
+                    ):
+                        anchor = element.find(".//a")
+                        if anchor is not None:
+                            fields["channel"] = "".join(anchor.itertext())
+                elif tag == "tp-yt-paper-dialog":
+                    if element.get("id") == "dialog":
+                        fields["modal"] = True
+                elif tag == "form":
+                    if element.get("id") == "captcha-form":
+                        fields["captcha"] = True
+                # the rest are divs, either holds a CAPTCHA challenge
+                elif "g-recaptcha" in element.get("class", "").split():
+                    fields["captcha"] = True
+                elif element.get("id") == "infoDiv":
+                    if "CAPTCHA" in "".join(element.itertext()):
+                        fields["captcha"] = True
+
+            found = fields["title"] is not None and (
+                fields["channel"] is not None)
+            return fields["captcha"] or (
+                found and (fields["modal"] or not find_modal))
+
+        for start in range(0, len(raw_html), YT_STREAM_CHUNK_SIZE):
+            parser.feed(raw_html[start:start + YT_STREAM_CHUNK_SIZE])
+            if read(parser.read_events()):
+                return fields
+
+        parser.close()
+        read(parser.read_events())
+        return fields
+
+    def _soup_fields(self, raw_html):
+        """Read the fields we need from a fully parsed page.
+
+        :param str raw_html: page source from the driver
+        :returns: the fields read from the page, see `page_fields`
+        :rtype: dict
+        """
+        bs4_obj = self.parse_page(raw_html)
+        fields = {"title": None, "channel": None,
+                  "modal": self.has_modal(bs4_obj),
+                  "captcha": self.has_captcha(bs4_obj)}
+        if not fields["captcha"]:
+            fields["title"] = self._video_title(bs4_obj)
+            fields["channel"] = self._channel_name(bs4_obj)
+        return fields
+
+    def page_fields(self, raw_html, find_modal=True):
+        """Read the video title, channel name and page state.
+
+        The page is streamed through lxml first, if that fails or does
+        not find the video details the page is parsed in full with bs4.
+
+        :param str raw_html: page source from the driver
+        :param bool find_modal: whether to look for the consent modal
+        :returns: the video title, channel name and whether the page has
+            a consent modal or CAPTCHA challenge
+        :rtype: dict
+        """
+        try:
+            fields = self._stream_fields(raw_html, find_modal=find_modal)
+        except etree.LxmlError as e:
+            logger.error("could not stream youtube page: %s", e)
+            return self._soup_fields(raw_html)
+
+        if not fields["captcha"] and (
+            fields["title"] is None or fields["channel"] is None
+        ):
+            logger.warning("video details not found, parsing full page")
+            return self._soup_fields(raw_html)
+        return fields
+
     def fetch(self, url, dry_run=False):
         """Fetch a given URL.
 
@@ -299,7 +491,7 @@ class YoutubeCrawler(crawler_base.Crawler):
             return metadata
 
         try:
-            self.parsed_html = self._request(
+            fields = self._request(
                 url,
                 check_consent=self.consent_passed
             )
@@ -307,10 +499,10 @@ class YoutubeCrawler(crawler_base.Crawler):
             helpers.write_error_urls(url)
             return metadata
 
-        if self.parsed_html and not self.has_captcha(self.parsed_html):
+        if not fields["captcha"]:
             metadata["url"] = url
-            metadata["title"] = self._video_title(self.parsed_html)
-            metadata["author"] = self._channel_name(self.parsed_html)
+            metadata["title"] = fields["title"]
+            metadata["author"] = fields["channel"]
             metadata["type"] = "V"
             metadata["source"] = f"{self.scheme}://{self.netloc}"
 
@@ -318,11 +510,31 @@ class YoutubeCrawler(crawler_base.Crawler):
 
 
 class JavascriptCrawler():
-    """Generic JS Crawler."""
-    def __init__(self):
-        self.khan_crawler = KhanAcademyCralwer()
-        self.yt_crawler = YoutubeCrawler()
-        logger.info("initiated youtube and khanacademy crawlers")
+    """Generic JS Crawler.
+
+    The site crawlers are only created the first time a url for that
+    site is fetched.
+    """
+
+    @functools.cached_property
+    def khan_crawler(self):
+        """Khan Academy crawler.
+
+        :returns: Khan Academy crawler
+        :rtype: KhanAcademyCralwer
+        """
+        logger.info("initiated khanacademy crawler")
+        return KhanAcademyCralwer()
+
+    @functools.cached_property
+    def yt_crawler(self):
+        """Youtube crawler.
+
+        :returns: Youtube crawler
+        :rtype: YoutubeCrawler
+        """
+        logger.info("initiated youtube crawler")
+        return YoutubeCrawler()
 
     def fetch(self, url, dry_run=False):
         """Fetch a JS page.
@@ -332,11 +544,11 @@ class JavascriptCrawler():
         :return: metadata for url
         :rtype: dict[str: str]
         """
-        metadata = {}
-        if "khanacademy" in url:
-            metadata = self.khan_crawler.fetch(url, dry_run=dry_run)
-
-        if "youtube" in url:
-            metadata = self.yt_crawler.fetch(url, dry_run=dry_run)
-
-        return metadata
+        host = urlparse(url).hostname or ""
+        crawler = SITE_CRAWLERS.get(host) or SITE_CRAWLERS.get(
+            host.split(".", 1)[-1])
+        if crawler is None:
+            logger.warning("no JS crawler for %s", url)
+            return {}
+
+        return getattr(self, crawler).fetch(url, dry_run=dry_run)
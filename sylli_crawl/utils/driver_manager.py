@@ -1,10 +1,15 @@
 """Manage browser drivers."""
 
+import atexit
+import collections
 from contextlib import contextmanager
 import logging
+import threading
 
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import (
+    NoSuchElementException, TimeoutException, WebDriverException)
+from selenium.webdriver.support.ui import WebDriverWait
 
 logger = logging.getLogger(__name__)
 
@@ -12,24 +17,35 @@ logger = logging.getLogger(__name__)
 WIDTH = "1920"
 HEIGHT = "1080"
 
+GECKODRIVER_PATH = "sylli_crawl/geckodriver/geckodriver"
 
-# reading if selenium gets clocked
-# https://intoli.com/blog/not-possible-to-block-chrome-headless/
+# page drivers are left on between uses so nothing keeps running
+BLANK_PAGE = "about:blank"
+# most drivers kept idle per browser setup, any more are quit
+MAX_IDLE_DRIVERS = 4
 
-# ram issue on vm running firefox:
-# stackoverflow.com/questions/55072731/selenium-using-too-much-ram-with-firefox
-# stackoverflow.com/questions/
-#   \63249385/selenium-automation-page-loading-is-very-slow
-@contextmanager
-def get_driver(headless=True):
-    """Configure selenium drive.
+# firefox prefs for a lightweight browser. we only read text from pages so
+# images, autoplaying media and the disk cache are just wasted work
+LIGHTWEIGHT_PREFS = {
+    "permissions.default.image": 2,
+    "media.autoplay.default": 5,
+    "browser.cache.disk.enable": False,
+}
 
-    :yields: a selenium webdriver
-    :raises WebDriverException: when webdriver cannot be initialised
+# drivers not currently in use, keyed on (headless, lightweight). starting
+# firefox takes seconds so drivers are kept and reused rather than quit
+_IDLE_DRIVERS = collections.defaultdict(list)
+_IDLE_LOCK = threading.Lock()
+
+
+def _firefox_options(headless=True, lightweight=True):
+    """Configure options for the firefox browser.
+
+    :param bool headless: run the browser without a window
+    :param bool lightweight: skip loading images and media
+    :returns: browser options
+    :rtype: selenium.webdriver.FirefoxOptions
     """
-    # driver var placeholder
-    driver = None
-    # configure options for firefox browser
     options = webdriver.FirefoxOptions()
     # set browser headless state
     options.headless = headless
@@ -42,22 +58,87 @@ def get_driver(headless=True):
     options.add_argument(f"--height={HEIGHT}")
     # set log level, we want to minimise noise
     options.add_argument("--log-level=3")
+    if lightweight:
+        for name, value in LIGHTWEIGHT_PREFS.items():
+            options.set_preference(name, value)
+    return options
+
+
+# reading if selenium gets clocked
+# https://intoli.com/blog/not-possible-to-block-chrome-headless/
+
+# ram issue on vm running firefox:
+# stackoverflow.com/questions/55072731/selenium-using-too-much-ram-with-firefox
+# stackoverflow.com/questions/
+#   \63249385/selenium-automation-page-loading-is-very-slow
+@contextmanager
+def get_driver(headless=True, lightweight=True):
+    """Configure selenium drive.
+
+    A driver left idle by a previous caller is reused if there is one,
+    otherwise a new one is started. Each driver is only used by one
+    caller at a time and is handed back for reuse afterwards, up to
+    `MAX_IDLE_DRIVERS` are kept and all of them are quit when the
+    program exits.
+
+    :param bool headless: run the browser without a window
+    :param bool lightweight: skip loading images and media, turn this
+        off when a page needs to be seen as a person would see it
+    :yields: a selenium webdriver
+    :raises WebDriverException: when webdriver cannot be initialised
+    """
+    key = (headless, lightweight)
+    with _IDLE_LOCK:
+        idle = _IDLE_DRIVERS[key]
+        # driver var placeholder
+        driver = idle.pop() if idle else None
+
     try:
-        driver = init_driver(
-            options=options,
-            executable_path="sylli_crawl/geckodriver/geckodriver",
-        )
+        if driver is None:
+            driver = init_driver(
+                options=_firefox_options(headless, lightweight),
+                executable_path=GECKODRIVER_PATH,
+            )
         yield driver
 
     except WebDriverException as e:
         logger.error("Webdriver Exception %s", e)
+        # the browser may be in a bad state, dont hand it out again
+        if driver:
+            quit_driver(driver)
+            driver = None
         raise e
 
     finally:
-        logger.info("Attempting to closing driver")
         if driver:
-            driver.close()
-            driver.quit()
+            _release_driver(driver, key)
+
+
+def _release_driver(driver, key):
+    """Hand a driver back to be reused.
+
+    The driver is moved off the page it was on so the page stops
+    running scripts while it waits. Cookies are kept, they hold things
+    like the youtube consent which every later request needs.
+
+    :param selenium.webdriver driver: the driver to hand back
+    :param tuple key: the (headless, lightweight) setup of the driver
+    """
+    try:
+        driver.get(BLANK_PAGE)
+    except WebDriverException as e:
+        logger.error("could not reset driver, quitting it: %s", e)
+        quit_driver(driver)
+        return
+
+    with _IDLE_LOCK:
+        idle = _IDLE_DRIVERS[key]
+        if len(idle) < MAX_IDLE_DRIVERS:
+            idle.append(driver)
+            return
+
+    # enough drivers are already waiting
+    quit_driver(driver)
 
 
 def init_driver(*args, **kwargs):
@@ -70,3 +151,70 @@ def init_driver(*args, **kwargs):
     """
     driver = webdriver.Firefox(*args, **kwargs)
     return driver
+
+
+def wait_until(driver, condition, timeout):
+    """Wait for a page to be ready.
+
+    This returns as soon as the condition is met rather than always
+    waiting for the full timeout.
+
+    :param selenium.webdriver driver: the browser driver
+    :param callable condition: called with the driver until it returns
+        something truthy
+    :param int timeout: maximum seconds to wait
+    :returns: true if the condition was met before the timeout
+    :rtype: bool
+    """
+    try:
+        WebDriverWait(driver, timeout).until(condition)
+    except TimeoutException:
+        # the page may still be usable e.g. a consent form is showing
+        logger.warning("page not ready after %ss, carrying on", timeout)
+        return False
+    return True
+
+
+def any_element_present(*locators):
+    """Build a wait condition met by the first of several elements.
+
+    Selenium 3 has no `expected_conditions.any_of` so this does the same
+    job for element locators.
+
+    :param tuple locators: (by, value) pairs to look for
+    :returns: a condition for `wait_until`, called with the driver it
+        returns the first element found or false
+    :rtype: callable
+    """
+    def condition(driver):
+        for by, value in locators:
+            try:
+                return driver.find_element(by, value)
+            except NoSuchElementException:
+                continue
+        return False
+    return condition
+
+
+def quit_driver(driver):
+    """Shut down a driver and its browser.
+
+    :param selenium.webdriver driver: the driver to quit
+    """
+    logger.info("Attempting to closing driver")
+    try:
+        # quit closes every window as well as the browser
+        driver.quit()
+    except WebDriverException as e:
+        logger.error("failed to quit driver: %s", e)
+
+
+@atexit.register
+def quit_idle_drivers():
+    """Quit every driver waiting to be reused."""
+    with _IDLE_LOCK:
+        drivers = [d for idle in _IDLE_DRIVERS.values() for d in idle]
+        _IDLE_DRIVERS.clear()
+
+    for driver in drivers:
+        quit_driver(driver)
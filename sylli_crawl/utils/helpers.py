@@ -1,18 +1,20 @@
-# pylint: disable = unspecified-encoding
 """Shared helpers."""
 
+import atexit
 from datetime import datetime
-import json
 import logging
 import os
 import pathlib
 import pickle
 import random
+import shelve
+import threading
 import time
 
+import orjson
 import requests
 
-from . import headers
+from . import sessions
 from .driver_manager import get_driver
 
 logger = logging.getLogger(__name__)
@@ -21,8 +23,29 @@ logger = logging.getLogger(__name__)
 COOKIE_PATH = pathlib.Path(os.environ.get("COOKIE_PATH", "cookies"))
 ERROR_DIR = pathlib.Path(os.environ.get("ERROR_DIR", "files/html-error-dumps"))
 ERROR_URL_FILE = pathlib.Path(
-    os.environ.get("ERROR_URL_FILE", "files/error-urls.json"))
+    os.environ.get("ERROR_URL_FILE", "files/error-urls.jsonl"))
 TEST_FILE_DIR = pathlib.Path(os.environ.get("TEST_FILE_DIR", "tests"))
+CACHE_FILE = pathlib.Path(
+    os.environ.get("CACHE_FILE", "files/cache/crawl-cache"))
+
+# seconds a cached response is considered fresh for
+CACHE_MAX_AGE = 24 * 60 * 60
+# shelve does not support concurrent access, crawlers run in threads
+_CACHE_LOCK = threading.Lock()
+# open cache files by path. a cache is opened the first time it is used and
+# kept open for the rest of the run, they are closed on exit
+_OPEN_CACHES = {}
+
+
+def wait_time(start=6, end=45):
+    """Pick a random time period from a range.
+
+    :param int start: start of the range
+    :param int end: end of the range
+    :returns: seconds to wait
+    :rtype: int
+    """
+    return random.randint(start, end)
 
 
 def wait(start=6, end=45):
@@ -31,7 +54,7 @@ def wait(start=6, end=45):
     :param int start: start of the range
     :param int end: end of the range
     """
-    sleep_time = random.choice(range(start, end + 1))
+    sleep_time = wait_time(start, end)
     logger.info("sleeping for %s", sleep_time)
     time.sleep(sleep_time)
 
@@ -43,8 +66,9 @@ def get(url):
     :returns: a response object
     :rtype: requests.Response
     """
-    resp = requests.get(
-        url, headers=headers.firefox_headers(), timeout=1)
+    # the shared session keeps connections alive and already sends the
+    # firefox headers
+    resp = sessions.SESSION.get(url, timeout=1)
     return resp
 
 
@@ -71,8 +95,9 @@ def write_html(data, file_path):
     :param str data: the data to be written
     :param pathlib.Path file_path: location to write to
     """
-    with open(file_path, "w") as fd:
-        fd.write(data)
+    # encode up front and write the raw bytes, skipping the text layer
+    with open(file_path, "wb") as fd:
+        fd.write(data.encode("utf-8"))
     logger.info("saved file to %s", file_path)
 
 
@@ -83,17 +108,18 @@ def read_json(path):
     :returns: contents of the json file
     :rtype: dict
     :raises ValueError: if file does not exist
-    :raises json.JSONDecodeError: if file cannot be parsed
+    :raises orjson.JSONDecodeError: if file cannot be parsed
     """
     contents = None  # will be returned regardless of any errors
     if not path.exists():
         logger.error("%s does not exist", path)
         return contents
 
-    with open(path, "r") as fd:
+    # orjson parses bytes directly, no need to decode the file first
+    with open(path, "rb") as fd:
         try:
-            contents = json.load(fd)
-        except json.JSONDecodeError as e:
+            contents = orjson.loads(fd.read())
+        except orjson.JSONDecodeError as e:
             logger.error(e)
     return contents
 
@@ -104,8 +130,67 @@ def write_json(data, path):
     :param dict data: data to be saved
     :param pathlib.Path path: location to save data
     """
-    with open(path, "w") as fd:
-        json.dump(data, fd, indent=4)
+    # orjson serialises straight to UTF-8 bytes so the file gets a single
+    # write. it is called for every crawled url so the speed matters
+    payload = orjson.dumps(
+        data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+    with open(path, "wb") as fd:
+        fd.write(payload)
+
+
+def _open_cache():
+    """Get the on-disk cache, opening it the first time it is used.
+
+    Only call this while holding `_CACHE_LOCK`.
+
+    :returns: the open cache
+    :rtype: shelve.Shelf
+    """
+    db = _OPEN_CACHES.get(CACHE_FILE)
+    if db is None:
+        mkdir(CACHE_FILE.parent)
+        db = _OPEN_CACHES[CACHE_FILE] = shelve.open(str(CACHE_FILE))
+    return db
+
+
+@atexit.register
+def close_caches():
+    """Close every open cache, writing out anything not yet saved."""
+    with _CACHE_LOCK:
+        while _OPEN_CACHES:
+            _, db = _OPEN_CACHES.popitem()
+            db.close()
+
+
+def read_cache(key, max_age=CACHE_MAX_AGE):
+    """Read a value from the on-disk cache.
+
+    :param str key: the key the value was saved under
+    :param int max_age: seconds a cached value is valid for
+    :returns: the cached value or None if missing or expired
+    :rtype: object
+    """
+    with _CACHE_LOCK:
+        entry = _open_cache().get(key)
+
+    if entry is None:
+        return None
+
+    saved_at, value = entry
+    if time.time() - saved_at > max_age:
+        logger.info("cached value for %s has expired", key)
+        return None
+    return value
+
+
+def write_cache(key, value):
+    """Save a value to the on-disk cache.
+
+    :param str key: the key to save the value under
+    :param object value: a picklable value to save
+    """
+    with _CACHE_LOCK:
+        _open_cache()[key] = (time.time(), value)
 
 
 def dump_pretty_html(bs4_obj, crawler_name):
@@ -144,22 +229,46 @@ def save_test_html(url, tests_file_path):
 
 
 def save_cookies(save_file, url):
-    """Pickle generic browser cookies.
+    """Save generic browser cookies as JSON.
 
-    This uses selenium to get the browser cookies.
+    This uses selenium to get the browser cookies. They are always written
+    to a .json file, an old .pkl path is swapped for the JSON file next to
+    it in the same way `read_cookies` does.
 
     :param str save_file: path to write to
     :param str url: the url to request
     """
+    path = pathlib.Path(save_file).with_suffix(".json")
     with get_driver(headless=True) as driver:
         driver.get(url)
         wait(start=10, end=15)
-        with open(save_file, "wb") as fd:
-            pickle.dump(driver.get_cookies(), fd)
+        write_json(driver.get_cookies(), path)
 
     logging.info("browser cookies successfully saved.")
 
 
+def read_cookies(path):
+    """Read saved browser cookies.
+
+    Cookies used to be pickled. If there is no JSON file but there is a
+    pickled one next to it with a .pkl suffix, that is converted to
+    JSON first.
+
+    :param pathlib.Path path: the JSON cookie file
+    :returns: the saved cookies or None if there are none
+    :rtype: list[dict]
+    """
+    legacy_path = path.with_suffix(".pkl")
+    if not path.exists() and legacy_path.exists():
+        logger.info("converting pickled cookies %s to JSON", legacy_path)
+        with open(legacy_path, "rb") as fd:
+            write_json(pickle.load(fd), path)
+
+    if not path.exists():
+        return None
+    return read_json(path)
+
+
 def write_error_urls(url):
     """Record URLs that result in a HTTP error.
 
@@ -168,14 +277,29 @@ def write_error_urls(url):
     has failed so it is useful to record these URL to check if it
     is a cloudflare issue or not.
 
+    Each error is appended to the file as a line of JSON, a small
+    append is a single write so this is safe from several threads.
+
     :param str url: the url that raised the HTTPError
     """
-
     logger.info("saving %s to url error file", url)
-    # optimistic read
-    pre_existing_errors = read_json(ERROR_URL_FILE)
-    if not pre_existing_errors:
-        pre_existing_errors = {"errors": []}
+    line = orjson.dumps(
+        {"url": url, "ts": time.time()}, option=orjson.OPT_APPEND_NEWLINE)
+    with open(ERROR_URL_FILE, "ab") as fd:
+        fd.write(line)
+
 
-    pre_existing_errors["errors"].append(url)
-    write_json(pre_existing_errors, ERROR_URL_FILE)
+def read_error_urls():
+    """Read the recorded error URLs.
+
+    :yields: each error entry with the url and when it was recorded
+    :rtype: dict[str: str | float]
+    """
+    if not ERROR_URL_FILE.exists():
+        logger.error("%s does not exist", ERROR_URL_FILE)
+        return
+
+    with open(ERROR_URL_FILE, "rb") as fd:
+        for line in fd:
+            if line.strip():
+                yield orjson.loads(line)
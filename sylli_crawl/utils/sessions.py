@@ -0,0 +1,46 @@
+"""Shared HTTP session for the crawlers."""
+import atexit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import headers
+
+# connection pool sizing. connections are kept alive so every request to
+# a host after the first reuses its TCP/TLS connection
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 64
+
+# retry connection errors a couple of times before giving up
+MAX_RETRIES = Retry(total=2, backoff_factor=0.3)
+
+
+def new_session():
+    """Create a pooled session.
+
+    :returns: a session with keep-alive connection pools for http and
+        https and Firefox headers set by default
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=MAX_RETRIES,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # crawlers only need to pass headers that differ from these
+    session.headers.update(headers.firefox_headers())
+    return session
+
+
+# shared by every crawler for the lifetime of the program
+SESSION = new_session()
+
+
+@atexit.register
+def close_session():
+    """Close the pooled connections of the shared session."""
+    SESSION.close()
@@ -1,40 +1,69 @@
 
 import datetime
+import functools
+import pathlib
+from unittest import mock
 
+from bs4 import BeautifulSoup
+import orjson
 import pytest
 import requests
 
+from sylli_crawl import google_crawler, js_crawler
 
 TESTS_DIR = "tests/html-files"
 
 
-@pytest.fixture(name="mock_request")
+@pytest.fixture(name="no_sleep", autouse=True, scope="session")
+def _no_sleep():
+    # nothing under test should really wait. patched once for the whole
+    # run, tests that check sleep calls patch it again on top of this
+    with mock.patch("time.sleep", return_value=None):
+        yield
+
+
+@functools.lru_cache(maxsize=64)
+def _read_html(file_path):
+    # the html files are large and read by many tests, only read each once.
+    # strings are immutable so sharing them between tests is safe
+    full_file_path = f"{TESTS_DIR}/{file_path}"
+    with open(full_file_path, "r") as rf:
+        return rf.read()
+
+
+@pytest.fixture(name="mock_request", scope="session")
 def _mock_request():
-    print("in mock request")
-    def ret_html(file_path):
-        print("in ret_")
-        full_file_path = f"{TESTS_DIR}/{file_path}"
-        html_str = None
-        with open(full_file_path, "r") as rf:
-            html_str = rf.read()
-        return html_str
-    return ret_html
-
-
-@pytest.fixture(name="response_object")
+    return _read_html
+
+
+@pytest.fixture(name="modal_soup", scope="session")
+def _modal_soup(mock_request):
+    # the google consent page parsed the same way the crawler does it.
+    # parse_page and parse_video only read the tree so it can be shared
+    return BeautifulSoup(
+        mock_request("test-google-modal.html"), "lxml",
+        parse_only=google_crawler.PARSE_ONLY,
+    )
+
+
+@pytest.fixture(name="response_object", scope="session")
 def _response_object():
     # docs: https://requests.readthedocs.io/en/latest/_modules/requests/models/#Response
     def set_status(text=None, status_code=200, url="https://some-fake.site"):
         resp = requests.Response()
         resp._content = bytes(text,'UTF-8')
+        # the body has already been read, there is no raw stream
+        resp._content_consumed = True
         resp.status_code = status_code
         resp.url = url
         return resp
     return set_status
 
 
-@pytest.fixture(name="response")
+@pytest.fixture(name="response", scope="session")
 def _response(mock_request, response_object):
+    # the factories live for the whole run, every call still builds a new
+    # response because a response body can only be read once
     def inner(file_path, status_code=200):
         text = mock_request(file_path)
         resp = response_object(text=text, status_code=status_code)
@@ -42,6 +71,29 @@ def _response(mock_request, response_object):
     return inner
 
 
+@pytest.fixture(name="load_json", scope="session")
+def _load_json():
+    # read json written by the code under test, orjson parses the bytes
+    # straight from disk
+    def load(path):
+        return orjson.loads(pathlib.Path(path).read_bytes())
+    return load
+
+
+@pytest.fixture(name="google", scope="module")
+def _google():
+    # shared by the tests in a module, only use it in tests that dont
+    # depend on a freshly made crawler
+    return google_crawler.GoogleCrawler()
+
+
+@pytest.fixture(name="yt", scope="module")
+def _yt():
+    # shared by the tests in a module, tests that patch the cookie path
+    # or count cookie loads need their own crawler
+    return js_crawler.YoutubeCrawler()
+
+
 @pytest.fixture(name="fake_datetime")
 def _fake_datetime():
     # returns 01/01/2023-01:00:00
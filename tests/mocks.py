@@ -0,0 +1,19 @@
+class MockDriver:
+    """Stand-in for a selenium driver that serves a fixed page."""
+    # the crawler keeps weak references to the drivers it has primed
+    __slots__ = ("page_source", "__weakref__")
+
+    def __init__(self, page_source=None):
+        self.page_source = page_source
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+    def get(self, url):
+        return self.page_source
+
+    def find_element(self, by, value):
+        return self.page_source
@@ -10,7 +10,6 @@ def test_search_engine_results_found(mocker, response):
     )
     bing_test = bing_crawler.BingCrawler()
     actual_out = bing_test.fetch("some query")
-    # print(actual_out)
     expected_out = [
         "https://www.imdb.com/title/tt9418812/",
         "https://code.org/helloworld",
@@ -46,3 +45,47 @@ def test_ensure_nth_page_query_correctly_formed():
 def test_headers_set_correctly():
     b_crawler = bing_crawler.BingCrawler()
     assert b_crawler.headers["Host"] == "www.bing.com" 
+
+
+def test_query_special_characters_escaped():
+    b_crawler = bing_crawler.BingCrawler()
+    actual_out = b_crawler.construct_query("c++ & python")
+    expected_out = "https://www.bing.com/search?q=c%2B%2B+%26+python&first=1"
+    assert actual_out == expected_out
+
+
+def test_parse_with_retry_backs_off(mocker, response):
+    sleep = mocker.patch("time.sleep", return_value=None)
+    request = mocker.patch(
+        "sylli_crawl.bing_crawler.BingCrawler._request",
+        return_value=response("test-bing.html")
+    )
+    mocker.patch(
+        "sylli_crawl.bing_crawler.BingCrawler.parse_page",
+        return_value=[]
+    )
+    b_crawler = bing_crawler.BingCrawler()
+    assert b_crawler.parse_with_retry("https://www.bing.com/search") == []
+    # every retry is used, waiting 1, 1.5, 2.25 ... between them with
+    # each wait capped at 15s
+    assert request.call_count == 10
+    assert sleep.call_count == 9
+    next_wait_time = 1
+    for call in sleep.call_args_list:
+        assert min(0.5 * next_wait_time, 15) <= call.args[0]
+        assert call.args[0] <= min(1.5 * next_wait_time, 15)
+        next_wait_time *= 1.5
+
+
+def test_empty_page_has_no_results(mocker, response_object):
+    request = mocker.patch(
+        "sylli_crawl.bing_crawler.BingCrawler._request",
+        return_value=response_object(text="")
+    )
+    dump = mocker.patch("sylli_crawl.utils.helpers.dump_pretty_html")
+    b_crawler = bing_crawler.BingCrawler()
+    assert b_crawler.fetch("some query") == []
+    # the empty page is retried and dumped like any other page without
+    # results
+    assert request.call_count == 10
+    dump.assert_called_once()
@@ -1,9 +1,12 @@
-import json
+import copy
 import pathlib
 import os
+import types
 
+import orjson
 import pytest
 from crawl import _api, _globals
+from sylli_crawl.utils import helpers
 
 
 class MockCrawler:
@@ -14,14 +17,28 @@ class MockCrawler:
         return {"mock": some_input}
 
 
+class MockEngine:
+    def __init__(self, results):
+        self.results = results
+
+    def fetch(self, query, page=1, dry_run=False):
+        return self.results
+
+
 FAKE_SET = {
     "https://www.tutorialsteacher.com/python/python-idle",
     "https://www.python.org/downloads/",
     "https://python101.pythonlibrary.org/chapter1_idle.html",
 }
+# the crawl code turns the set straight into a list, so the expected
+# results have to keep the set's own order rather than being sorted
+FAKE_LIST = list(FAKE_SET)
 
 
-mock_curriculum_data = {
+# only ever read by the code under test. the proxy only makes the top
+# level read-only, the nested levels, modules and topics can still be
+# changed so tests must not modify them
+mock_curriculum_data = types.MappingProxyType({
     "course": "computer science",
     "levels": [
         {
@@ -37,7 +54,10 @@ mock_curriculum_data = {
             ]
         }
     ]
-}
+})
+
+# topics in the only module of mock_curriculum_data
+MOCK_TOPICS = mock_curriculum_data["levels"][0]["modules"][0]["topics"]
 
 mock_search_results_data = {
     "IDLE Programming python": {
@@ -64,7 +84,7 @@ mock_fetched_data =  {
 mock_data_from_search_engine_scrape = [{
     "query": "I am a query",
     "meta-data": "some/fake/meta-data/path",
-    "search-results": list(FAKE_SET),
+    "search-results": FAKE_LIST,
     "last-discovered": -1,
 }]
 
@@ -83,51 +103,85 @@ mock_search_res_data = {
                                                 'https://www.python.org/downloads/']}
 }
 
+# where search_results_processor should write the resources for the
+# "IDLE Programming python" query in mock_search_results_data
+EXPECTED_SLUG = "IDLE-Programming-python"
+EXPECTED_PATH_FRAGMENT = (
+    f"computer-science/university-year-1/python-101/{EXPECTED_SLUG}")
+
 # for mocking _globals.CRAWLERS
-crawler_mock = {
-    "web": {
-        "html": MockCrawler(),
-        "js": MockCrawler()
-    }
-}
+crawler_mock = types.SimpleNamespace(
+    html=MockCrawler(),
+    js=MockCrawler(),
+)
+
+
+@pytest.fixture(name="no_politeness_wait")
+def _no_politeness_wait(mocker, monkeypatch):
+    # politeness waits are tracked per website rather than slept, start
+    # with no website waiting and dont make any wait after a fetch
+    monkeypatch.setattr(_api, "_HOST_NEXT_FETCH", {})
+    mocker.patch("sylli_crawl.utils.helpers.wait_time", return_value=0)
+
+
+@pytest.fixture(name="cli_env")
+def _cli_env(mocker, monkeypatch, tmp_path, no_politeness_wait):
+    # network calls are mocked out and every CLI folder points at its own
+    # dir in tmp_path
+    env = types.SimpleNamespace(
+        fetch_query=mocker.patch(
+            "crawl._api.fetch_query", return_value=FAKE_SET),
+        fetch_url=mocker.patch(
+            "crawl._api.fetch_url", return_value=mock_fetched_data),
+        query_dir=tmp_path / "querys",
+        search_dir=tmp_path / "search-results",
+        resources_dir=tmp_path / "resources",
+    )
+    for folder in (env.query_dir, env.search_dir, env.resources_dir):
+        folder.mkdir()
+    monkeypatch.setattr(_globals, "QUERY_FOLDER", env.query_dir)
+    monkeypatch.setattr(_globals, "SEARCH_RESULT_OUT_FOLDER", env.search_dir)
+    monkeypatch.setattr(_globals, "RESOURCES_OUT_FOLDER", env.resources_dir)
+    return env
 
 
 def test_api_process_happy(mocker):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch("random.shuffle", return_value=list(FAKE_SET))
+    mocker.patch(
+        "random.sample", side_effect=lambda population, k: list(population))
     mocker.patch(
         "crawl._api.fetch_query", return_value=FAKE_SET)
 
-    topic_index = 0
-    expected_out = {
-        "meta-data": "computer-science/university-year-1/python-101",
-        "search-results": list(FAKE_SET),
-        "last-discovered": -1,
-    }
-    for out in _api.process(mock_curriculum_data):
-        expected_out["query"] = mock_curriculum_data["levels"][0]["modules"][0]["topics"][topic_index]
-        assert out == expected_out
-        topic_index += 1
+    expected_out = [
+        {
+            "query": topic,
+            "meta-data": "computer-science/university-year-1/python-101",
+            "search-results": FAKE_LIST,
+            "last-discovered": -1,
+        }
+        for topic in MOCK_TOPICS
+    ]
+    assert list(_api.process(mock_curriculum_data)) == expected_out
 
 
 def test_api_process_no_results(mocker):
-    mocker.patch("time.sleep", return_value=None)
     mocker.patch(
         "crawl._api.fetch_query", return_value=set())
 
-    topic_index = 0
-    expected_out = {
-        "meta-data": "computer-science/university-year-1/python-101",
-        "search-results": [],
-        "last-discovered": -1,
-    }
-    for out in _api.process(mock_curriculum_data):
-        expected_out["query"] = mock_curriculum_data["levels"][0]["modules"][0]["topics"][topic_index]
-        assert out == expected_out
-        topic_index += 1
+    expected_out = [
+        {
+            "query": topic,
+            "meta-data": "computer-science/university-year-1/python-101",
+            "search-results": [],
+            "last-discovered": -1,
+        }
+        for topic in MOCK_TOPICS
+    ]
+    assert list(_api.process(mock_curriculum_data)) == expected_out
 
 
-def test_course_processor_creates_correct_files(mocker, tmpdir):
+def test_course_processor_creates_correct_files(
+    mocker, monkeypatch, tmp_path, load_json
+):
     mocker.patch(
         "crawl._api.process",
         return_value=mock_data_from_search_engine_scrape
@@ -136,18 +190,17 @@ def test_course_processor_creates_correct_files(mocker, tmpdir):
         "sylli_crawl.utils.helpers.read_json",
         return_value=mock_curriculum_data
     )
-    mocker.patch.object(_globals, "SEARCH_RESULT_OUT_FOLDER", tmpdir)
+    monkeypatch.setattr(_globals, "SEARCH_RESULT_OUT_FOLDER", tmp_path)
     # run curriculum processor
     _api.course_processor(pathlib.Path("some/fake/path"))
 
-    assert len(tmpdir.listdir()) == 1
-    for file in tmpdir.listdir():
+    assert len(list(tmp_path.iterdir())) == 1
+    for file in tmp_path.iterdir():
         # this should be the basename of the original file input into
         # course_processor
-        assert file.basename == "path"
-        with open(file, "r") as fd:
-            actual = json.load(fd)
-            assert actual == {mock_data_from_search_engine_scrape[0]["query"]: mock_data_from_search_engine_scrape[0]}
+        assert file.name == "path"
+        actual = load_json(file)
+        assert actual == {mock_data_from_search_engine_scrape[0]["query"]: mock_data_from_search_engine_scrape[0]}
 
 
 def test_api_course_processor_no_course_data(mocker):
@@ -155,148 +208,109 @@ def test_api_course_processor_no_course_data(mocker):
     assert _api.course_processor("some/full/path") == 1
 
 
-def test_api_search_res_processor_happy(mocker, tmpdir):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "crawl._api.fetch_url",
-        return_value=mock_fetched_data
-    )
+def test_api_search_res_processor_happy(mocker, cli_env, load_json):
+    # the search results are only read once, resource files dont exist
+    # yet so they are never read. the processor updates the data it
+    # reads so it gets its own copy
     mocker.patch(
-        "crawl._api.update_save_json",
-        return_value=None
+        "sylli_crawl.utils.helpers.read_json",
+        return_value=copy.deepcopy(mock_search_results_data)
     )
-    mocker.patch.object(
-        _globals, "RESOURCES_OUT_FOLDER", tmpdir)
-    # we need to write data to the search-results dir so we
-    # can avoid mocking out `read_json` as it is used in multiple
-    # functions we want to test
-    some_fake_file = pathlib.Path(f"{tmpdir}/test-example.json")
-    with open(some_fake_file, "w") as fd:
-        json.dump(mock_search_results_data, fd)
+    some_fake_file = cli_env.search_dir / "test-example.json"
 
     _api.search_results_processor(some_fake_file)
 
-    cat_path = _globals.RESOURCES_OUT_FOLDER / "computer-science/university-year-1/python-101"
-    assert len(cat_path.listdir()) == 1
-    for file in cat_path.listdir():
-        assert f'{mock_search_results_data["IDLE Programming python"]["meta-data"]}/{mock_search_results_data["IDLE Programming python"]["query"].replace(" ", "-")}' in str(file)
-        with open(file, "r") as f:
-            out = json.load(f)
-            # each resource file should only contain one key
-            assert len(out) == 1
-            for key in out.keys():
-                # the input data contains two topics, output will be 2 fetched
-                # resources
-                assert len(out[key]) == 2
-                # we just need to check the first one as any requests are
-                # mocked out to return mock_fetched_data
-                # this is a check to make sure the correct information is
-                # written
-                assert out[key][0] == mock_fetched_data
-
-
-def test_end_to_end_dispatch_query(mocker, tmpdir):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch("random.shuffle", return_value=list(FAKE_SET))
+    resource_file = cli_env.resources_dir / EXPECTED_PATH_FRAGMENT
+    assert {p.name for p in resource_file.parent.iterdir()} == {EXPECTED_SLUG}
+    out = load_json(resource_file)
+    # each resource file should only contain one key
+    assert len(out) == 1
+    for key in out.keys():
+        # the input data contains two topics, output will be 2 fetched
+        # resources
+        assert len(out[key]) == 2
+        # we just need to check the first one as any requests are
+        # mocked out to return mock_fetched_data
+        # this is a check to make sure the correct information is
+        # written
+        assert out[key][0] == mock_fetched_data
+
+
+@pytest.mark.slow
+def test_end_to_end_dispatch_query(mocker, cli_env, load_json):
     mocker.patch(
-        "crawl._api.fetch_query", return_value=FAKE_SET
-    )
-    query_dir = tmpdir.mkdir("querys")
-    search_dir = tmpdir.mkdir("search-results")
-    # tmpdir is a py.path.local object not pathlib.Path
-    # so we need to convert
-    # https://py.readthedocs.io/en/latest/path.html
-    mocker.patch.object(
-        _globals, "QUERY_FOLDER", pathlib.Path(query_dir)
-    )
-    mocker.patch.object(
-        _globals, "SEARCH_RESULT_OUT_FOLDER", pathlib.Path(search_dir)
-    )
+        "random.sample", side_effect=lambda population, k: list(population))
+    query_dir = cli_env.query_dir
+    search_dir = cli_env.search_dir
 
     fake_resources = query_dir / "some-fake-resource.json"
     # add data
-    with open(fake_resources, "w") as fd:
-        json.dump(mock_curriculum_data, fd)
+    fake_resources.write_bytes(orjson.dumps(dict(mock_curriculum_data)))
 
-    
     _api.dispatch("query")
-    assert len(search_dir.listdir()) == 1
+    assert {p.name for p in search_dir.iterdir()} == {fake_resources.name}
 
-    topic_list = mock_curriculum_data["levels"][0]["modules"][0]["topics"]
-    for file in search_dir.listdir():
-        # read contents and assert its correct
-        expected_out = {
+    # one entry per topic, keyed by the topic itself
+    expected_out = {
+        topic: {
+            "query": topic,
             "meta-data": "computer-science/university-year-1/python-101",
-            "search-results": list(FAKE_SET),
+            "search-results": FAKE_LIST,
             "last-discovered": -1,
         }
-        with open(file, "r") as fd:
-            actual_out = json.load(fd)
-            for key, value in actual_out.items():
-                # this is not fixed so we need to add it during the test
-                expected_out["query"] = key
-                assert value == expected_out
+        for topic in MOCK_TOPICS
+    }
+    assert load_json(search_dir / fake_resources.name) == expected_out
 
     # we want to make sure all the files have been processed properly
-    # and not start with a `_` symbol
+    # and start with a `_` symbol
     assert not fake_resources.exists()
-    for file in query_dir.listdir():
-        assert file.basename.startswith("_")
+    assert {p.name for p in query_dir.iterdir()} == {
+        f"_{fake_resources.name}"}
 
 
-def test_end_to_end_dispatch_search(mocker, tmpdir):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "crawl._api.fetch_url", return_value=mock_fetched_data
-    )
+@pytest.mark.slow
+def test_end_to_end_dispatch_search(mocker, cli_env, load_json):
+    search_dir = cli_env.search_dir
+    res_out_folder = cli_env.resources_dir
 
-    search_dir = tmpdir.mkdir("search-results")
-    res_out_folder = tmpdir.mkdir("resources")
-
-    # tmpdir is a py.path.local object not pathlib.Path
-    # so we need to convert
-    # https://py.readthedocs.io/en/latest/path.html
-    mocker.patch.object(
-        _globals, "SEARCH_RESULT_OUT_FOLDER", pathlib.Path(search_dir)
-    )
-    mocker.patch.object(
-        _globals, "RESOURCES_OUT_FOLDER", pathlib.Path(res_out_folder)
+    # the file only needs to exist to be picked up, its contents come
+    # from the mocked read
+    mocker.patch(
+        "sylli_crawl.utils.helpers.read_json",
+        return_value=copy.deepcopy(mock_search_res_data)
     )
-
-    # write fake data to search results directory
     fake_data_path = search_dir / "test-example.json"
-    with open(fake_data_path, "w") as fd:
-        json.dump(mock_search_res_data, fd)
+    fake_data_path.write_text("")
 
     _api.dispatch("search")
 
     # check correct dirs exist
     path_to_base = res_out_folder / "computer-science/university-year-1/python-101"
-    assert path_to_base.check()
-    # check correct number of files have been created
-    assert len(path_to_base.listdir()) == len(mock_search_res_data)
-    for file in path_to_base.listdir():
-        with open(file, "r") as fd:
-            actual_out = json.load(fd)
-            # we should only have one key in this file
-            assert len(actual_out) == 1
-            for key in actual_out.keys():
-                # there should data for each of the URLs in FAKE_SET
-                assert len(actual_out[key]) == len(FAKE_SET)
+    assert path_to_base.is_dir()
+    # check one file has been created per query
+    assert {p.name for p in path_to_base.iterdir()} == {
+        query.replace(" ", "-") for query in mock_search_res_data}
+    # every file is built the same way from the mocked fetch_url, checking
+    # one of them is enough
+    actual_out = load_json(path_to_base / EXPECTED_SLUG)
+    # we should only have one key in this file
+    assert len(actual_out) == 1
+    for key in actual_out.keys():
+        # there should data for each of the URLs in FAKE_SET
+        assert len(actual_out[key]) == len(FAKE_SET)
 
     ### assertions on original "test-example.json"
-    # check no extra files have been created
-    assert len(search_dir.listdir()) == 1
-    # check file has been renamed and starts with _
+    # check file has been renamed to start with _ and no extra files
+    # have been created
     assert not fake_data_path.exists()
-    for file in search_dir.listdir():
-        assert file.basename.startswith("_")
+    assert {p.name for p in search_dir.iterdir()} == {"_test-example.json"}
     # check counter got updated
-    with open(search_dir / "_test-example.json", "r") as fd:
-        actual_out = json.load(fd)
-        for key in actual_out.keys():
-            # counter should be 2 as that was the last index crawled
-            assert actual_out[key]["last-discovered"] == 2
+    actual_out = load_json(search_dir / "_test-example.json")
+    for key in actual_out.keys():
+        # counter should be 2 as that was the last index crawled
+        assert actual_out[key]["last-discovered"] == 2
+
 
 @pytest.mark.parametrize("url,expected",
     [
@@ -309,6 +323,7 @@ def test_end_to_end_dispatch_search(mocker, tmpdir):
             }
         ),
         ("khanacademy.org", {"mock": "khanacademy.org"}),
+        ("youtube.com/some-pdf-site.pdf", {}),
     ]
 )
 def test_fetch_url(mocker, url, expected):
@@ -316,3 +331,139 @@ def test_fetch_url(mocker, url, expected):
 
     res = _api.fetch_url(url)
     assert res == expected
+
+
+def test_fetch_query_combines_engines(mocker):
+    mocker.patch.object(
+        _globals,
+        "CRAWLERS",
+        types.SimpleNamespace(
+            engines=[
+                MockEngine(["https://www.python.org/downloads/"]),
+                MockEngine(FAKE_LIST),
+            ]
+        )
+    )
+    res = _api.fetch_query("some query", set(), 1)
+    assert res == FAKE_SET
+
+
+def test_fetch_engine_pages_fetches_every_page(mocker):
+    engine = MockEngine(["https://www.python.org/downloads/"])
+    spy = mocker.spy(engine, "fetch")
+    res = _api.fetch_engine_pages(engine, "some query", 3)
+    assert res == {"https://www.python.org/downloads/"}
+    assert [c.kwargs["page"] for c in spy.call_args_list] == [1, 2, 3]
+
+
+def test_construct_search_result_object_keeps_input_order():
+    results = sorted(FAKE_SET)
+    obj = _api.construct_search_result_object("query", results, "meta")
+    assert results == sorted(FAKE_SET)
+    assert sorted(obj["search-results"]) == results
+
+
+def test_search_res_processor_fetches_each_url_once(cli_env):
+    some_fake_file = cli_env.search_dir / "test-example.json"
+    some_fake_file.write_bytes(orjson.dumps(mock_search_res_data))
+
+    _api.search_results_processor(some_fake_file)
+
+    # both queries share the same three URLs
+    assert cli_env.fetch_url.call_count == len(FAKE_SET)
+
+
+def test_crawlers_created_lazily(mocker):
+    bing = mocker.patch("sylli_crawl.bing_crawler.BingCrawler")
+    html = mocker.patch("sylli_crawl.html_crawler.HTMLCrawler")
+    crawlers = _globals._Crawlers()
+    assert crawlers.html is crawlers.html
+    assert html.call_count == 1
+    assert not bing.called
+
+
+@pytest.fixture(name="tmp_cache")
+def _tmp_cache(mocker, tmp_path):
+    mocker.patch(
+        "sylli_crawl.utils.helpers.CACHE_FILE",
+        tmp_path / "cache" / "crawl-cache"
+    )
+    yield
+    # the cache stays open once used, dont leave it open on a tmp file
+    helpers.close_caches()
+
+
+def test_cached_call_reuses_cached_result(mocker, tmp_cache):
+    func = mocker.Mock(return_value=["https://www.python.org/downloads/"])
+
+    first = _api.cached_call("some-key", func, use_cache=True)
+    second = _api.cached_call("some-key", func, use_cache=True)
+
+    assert first == (["https://www.python.org/downloads/"], False)
+    assert second == (["https://www.python.org/downloads/"], True)
+    assert func.call_count == 1
+
+
+def test_cache_opened_once(mocker, tmp_cache):
+    shelve_open = mocker.spy(helpers.shelve, "open")
+    assert helpers.read_cache("some-key") is None
+    helpers.write_cache("some-key", ["https://www.python.org/downloads/"])
+    assert helpers.read_cache("some-key") == [
+        "https://www.python.org/downloads/"]
+    assert shelve_open.call_count == 1
+
+
+def test_cached_call_skips_cache_when_disabled(mocker):
+    read_cache = mocker.patch("sylli_crawl.utils.helpers.read_cache")
+    func = mocker.Mock(return_value=["https://www.python.org/downloads/"])
+
+    assert _api.cached_call("some-key", func) == (func.return_value, False)
+    assert not read_cache.called
+
+
+def test_fetch_urls_keeps_input_order(mocker, no_politeness_wait):
+    mocker.patch("crawl._api.fetch_url", side_effect=lambda url, **_: url)
+    urls = [f"https://site-{i}.com/page" for i in range(20)]
+    assert list(_api.fetch_urls(urls)) == urls
+
+
+def test_fetch_politely_waits_without_lock(mocker, monkeypatch):
+    mocker.patch("crawl._api.fetch_url", side_effect=lambda url, **_: url)
+    monkeypatch.setattr(_api, "_HOST_NEXT_FETCH", {"a.com": 100})
+    mocker.patch("time.monotonic", side_effect=[90, 101, 101])
+    stop = mocker.Mock()
+    stop.is_set.return_value = False
+    lock = _api._host_lock("https://a.com/one")
+
+    def wait(delay):
+        # the website is free for other work while this fetch waits
+        assert not lock.locked()
+        assert delay == 10
+
+    stop.wait.side_effect = wait
+    mocker.patch("sylli_crawl.utils.helpers.wait_time", return_value=5)
+    assert _api._fetch_politely("https://a.com/one", stop) == (
+        "https://a.com/one")
+    assert stop.wait.call_count == 1
+
+
+def test_fetch_urls_cancels_queued_fetches(mocker, no_politeness_wait):
+    mocker.patch.object(_globals, "URL_FETCH_WORKERS", 1)
+    fetch_url = mocker.patch(
+        "crawl._api.fetch_url", side_effect=lambda url, **_: url)
+    urls = [f"https://site-{i}.com/page" for i in range(20)]
+    fetches = _api.fetch_urls(urls)
+    assert next(fetches) == urls[0]
+    fetches.close()
+    # only the URLs queued ahead of the first result were handed out
+    assert fetch_url.call_count <= _api.QUEUED_FETCHES_PER_WORKER + 1
+
+
+def test_host_lock_shared_per_website():
+    assert _api._host_lock("https://a.com/one") is _api._host_lock(
+        "https://a.com/two")
+    assert _api._host_lock("https://a.com/one") is not _api._host_lock(
+        "https://b.com/one")
+    # all browser based crawls share a lock
+    assert _api._host_lock("https://www.youtube.com/watch") is _api._host_lock(
+        "https://www.khanacademy.org/some-page")
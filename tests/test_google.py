@@ -5,10 +5,17 @@ import requests
 from sylli_crawl import google_crawler
 from sylli_crawl.utils import errors, helpers
 
+# mock.patch targets used across this module
+GOOGLE_REQUEST_PATCH = "sylli_crawl.google_crawler.GoogleCrawler._request"
+
+# the parts of a "some query 123" query either side of the start index
+QUERY_PREFIX = "https://www.google.com/search?q=some+query+123&start="
+QUERY_SUFFIX = "&safe=strict&ie=UTF-8"
+
 
 def test_search_engine_results_found(mocker, response):
     mocker.patch(
-        "sylli_crawl.google_crawler.GoogleCrawler._request",
+        GOOGLE_REQUEST_PATCH,
         return_value=response("test-google.html")
     )
     google_test = google_crawler.GoogleCrawler()
@@ -38,38 +45,43 @@ def test_search_engine_results_found(mocker, response):
     assert actual_out == expected_out
 
 
-def test_ensure_first_page_query_correctly_formed():
-    g_crawler = google_crawler.GoogleCrawler()
-    actual_out = g_crawler.construct_query("some query 123")
+def test_ensure_first_page_query_correctly_formed(google):
+    actual_out = google.construct_query("some query 123")
     expected_out = "https://www.google.com/" \
         "search?q=some+query+123&start=0&safe=strict&ie=UTF-8"
     assert actual_out == expected_out
 
 
-def test_ensure_nth_page_query_correctly_formed():
-    g_crawler = google_crawler.GoogleCrawler()
-    for i in range(1, 6):
-        actual_out = g_crawler.construct_query("some query 123", page=i)
-        page = (i - 1) * 10
-        expected_out = (
-            "https://www.google.com/"
-            f"search?q=some+query+123&start={page}"
-            "&safe=strict&ie=UTF-8"
-        )
-        assert actual_out == expected_out
-
-
-def test_headers_set_correctly():
-    g_crawler = google_crawler.GoogleCrawler()
-    assert g_crawler.headers["Sec-Fetch-Site"] == "same-origin"
+@pytest.mark.parametrize("page", range(1, 6))
+def test_ensure_nth_page_query_correctly_formed(page, google):
+    actual_out = google.construct_query("some query 123", page=page)
+    expected_out = f"{QUERY_PREFIX}{(page - 1) * 10}{QUERY_SUFFIX}"
+    assert actual_out == expected_out
 
 
-def test_modal_page(mocker, response):
-    mocker.patch("time.sleep", return_value=None)
+def test_query_special_characters_escaped(google):
+    actual_out = google.construct_query("c++ & python")
+    expected_out = (
+        "https://www.google.com/"
+        "search?q=c%2B%2B+%26+python&start=0&safe=strict&ie=UTF-8"
+    )
+    assert actual_out == expected_out
+
+
+def test_headers_set_correctly(google):
+    assert google.headers["Sec-Fetch-Site"] == "same-origin"
+
+
+def test_modal_page(mocker, response, modal_soup):
     mocker.patch(
-        "sylli_crawl.google_crawler.GoogleCrawler._request",
+        GOOGLE_REQUEST_PATCH,
         return_value=response("test-google-modal.html", 204)
     )
+    mocker.patch(
+        "sylli_crawl.google_crawler.GoogleCrawler._create_bs4_obj",
+        return_value=modal_soup
+    )
+    # fetch sets dry_run on the crawler, so dont use the shared one
     g_crawler = google_crawler.GoogleCrawler()
     actual = g_crawler.fetch("some-random-query")
     assert actual == [
@@ -86,8 +98,44 @@ def test_modal_page(mocker, response):
     ]
 
 
-def test_build_consent_url():
+def test_consent_url_decoded(mocker, response):
+    request = mocker.patch(
+        GOOGLE_REQUEST_PATCH,
+        return_value=response("test-google-modal.html", 204)
+    )
     g_crawler = google_crawler.GoogleCrawler()
+    g_crawler.fetch("some-random-query")
+    consent_call = request.call_args_list[1]
+    assert consent_call.args == (
+        "post",
+        "https://consent.google.com/save?continue=https://www.google.com/"
+        "search?q%3Dhello%2Bworld%26start%3D0%26safe%3Dstrict%26ie%3Dutf-8"
+        "%26oe%3Dutf-8&gl=GB&m=0&pc=srp&x=5&src=2&hl=en&"
+        "bl=gws_20220913-0_RC1&uxe=none&set_eom=true",
+    )
+
+
+@pytest.mark.parametrize("url, expected", [
+    (
+        "/url?q=https://www.nba.com/warriors/&sa=U&ved=2ahUKEwj",
+        "https://www.nba.com/warriors/",
+    ),
+    ("https://www.nba.com/warriors/", "https://www.nba.com/warriors/"),
+    ("/search?hl=en-GB&tbm=vid", "h?hl=en-GB"),
+])
+def test_clean_url(url, expected, google):
+    assert google._clean_url(url) == expected
+
+
+def test_parse_page_prefers_first_css_class(google):
+    bs4_obj = google._create_bs4_obj(
+        '<div class="g"><a href="https://old-layout.com/">a</a></div>'
+        '<div class="yuRUbf"><a href="https://new-layout.com/">b</a></div>'
+    )
+    assert google.parse_page(bs4_obj) == ["https://new-layout.com/"]
+
+
+def test_build_consent_url(google):
     consent_url = "https://consent.google.com/save"
     badly_formatted_str = (
         "https://consent.google.com/save?continue=https://www.google.com/"
@@ -99,24 +147,22 @@ def test_build_consent_url():
         "search?q%3Dhello%2Bworld&gl=GB&m=0&pc=srp&x=5&src=2&hl=en&"
         "bl=gws_20220913-0_RC1&uxe=none&set_eom=true"
     )
-    out = g_crawler._build_consent_url(badly_formatted_str)
+    out = google._build_consent_url(badly_formatted_str)
     assert f"{consent_url}?{out}" == expected_str
 
 
-def test_find_video(mock_request):
-    g_crawler = google_crawler.GoogleCrawler()
-    bs4_obj = g_crawler._create_bs4_obj(mock_request("test-google-modal.html"))
+def test_find_video(modal_soup, google):
     expected = [
         "https://www.youtube.com/watch?v=Yw6u6YkTgQ4",
         "https://www.youtube.com/watch?v=u7JMhVI7taQ",
         "https://www.youtube.com/watch?v=a25_gGnmJAw"
     ]
-    assert g_crawler.parse_video(bs4_obj) == expected
+    assert google.parse_video(modal_soup) == expected
 
 
 def test_bad_request(mocker, caplog):
     mocker.patch(
-        "sylli_crawl.google_crawler.GoogleCrawler._request",
+        GOOGLE_REQUEST_PATCH,
         side_effect=requests.exceptions.RequestException("something failed")
     )
     g_crawler = google_crawler.GoogleCrawler()
@@ -138,7 +184,7 @@ def test_bad_request(mocker, caplog):
 @freezegun.freeze_time("2023-01-01 01:00:00")
 def test_html_dump(mocker, tmpdir, response):
     mocker.patch(
-        "sylli_crawl.google_crawler.GoogleCrawler._request",
+        GOOGLE_REQUEST_PATCH,
         return_value=response("test-html-crawler.html", 200)
     )
     mocker.patch.object(helpers, "ERROR_DIR", tmpdir)
@@ -1,6 +1,10 @@
+import pathlib
+
 import pytest
+import requests
 
-from sylli_crawl import html_crawler
+from sylli_crawl import crawler_base, html_crawler
+from sylli_crawl.utils import helpers, sessions
 
 
 def test_title_found(mocker, response):
@@ -20,3 +24,111 @@ def test_title_found(mocker, response):
         "source": "some-website.com",
     }
     assert actual_out == expected_out
+
+
+def test_crawlers_share_session():
+    first = html_crawler.HTMLCrawler()
+    second = html_crawler.HTMLCrawler()
+    assert first.session is second.session
+
+
+def test_no_headers_overridden_per_request(mocker, response):
+    request = mocker.patch(
+        "sylli_crawl.html_crawler.HTMLCrawler._request",
+        return_value=response("test-html-crawler.html")
+    )
+    html_crawler.HTMLCrawler().fetch("https://some-website.com/some-path")
+    assert "headers" not in request.call_args.kwargs
+
+
+def test_parse_page_stops_reading_after_title():
+    read = []
+
+    def chunks():
+        for chunk in (b"<html><head><title>Some ", b"title</title>",
+                      b"</head><body>", b"lots of body</body></html>"):
+            read.append(chunk)
+            yield chunk
+
+    html = html_crawler.HTMLCrawler()
+    assert html.parse_page(chunks()) == "Some title"
+    assert len(read) == 2
+
+
+def test_parse_page_no_title():
+    html = html_crawler.HTMLCrawler()
+    assert html.parse_page([b"<html><body>no title</body></html>"]) is None
+
+
+def test_parse_page_uses_encoding():
+    html = html_crawler.HTMLCrawler()
+    page = "<title>Café – naïve</title>".encode()
+    assert html.parse_page([page], encoding="utf-8") == "Café – naïve"
+
+
+def test_declared_charset_used(mocker, response_object):
+    resp = response_object(text="<title>Café – naïve</title>")
+    # requests sets the encoding from the header on real responses
+    resp.headers["Content-Type"] = "text/html; charset=utf-8"
+    resp.encoding = "utf-8"
+    mocker.patch(
+        "sylli_crawl.html_crawler.HTMLCrawler._request", return_value=resp)
+    html = html_crawler.HTMLCrawler()
+    actual_out = html.fetch("https://some-website.com/some-path")
+    assert actual_out["title"] == "Café – naïve"
+
+
+def test_empty_page_recorded(mocker, tmp_path, response_object):
+    mocker.patch.object(helpers, "ERROR_URL_FILE", tmp_path / "errors.jsonl")
+    mocker.patch(
+        "sylli_crawl.html_crawler.HTMLCrawler._request",
+        return_value=response_object(text="")
+    )
+    url = "https://some-website.com/some-path"
+    html = html_crawler.HTMLCrawler()
+    assert html.fetch(url) == {}
+    assert [entry["url"] for entry in helpers.read_error_urls()] == [url]
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({}, crawler_base.DEFAULT_TIMEOUT),
+    ({"timeout": 1}, 1),
+    ({"timeout": (1, 2)}, (1, 2)),
+])
+def test_request_timeout(mocker, kwargs, expected):
+    session = mocker.Mock()
+    crawler = crawler_base.Crawler(session=session)
+    crawler._request("get", "https://some-website.com", **kwargs)
+    assert session.request.call_args.kwargs["timeout"] == expected
+
+
+def test_crawler_has_no_instance_dict():
+    html = html_crawler.HTMLCrawler()
+    assert not hasattr(html, "__dict__")
+    with pytest.raises(AttributeError):
+        html.some_new_attribute = True
+
+
+def test_failed_urls_recorded(mocker, tmpdir):
+    mocker.patch.object(
+        helpers, "ERROR_URL_FILE", pathlib.Path(tmpdir) / "errors.jsonl")
+    mocker.patch(
+        "sylli_crawl.html_crawler.HTMLCrawler._request",
+        side_effect=requests.exceptions.RequestException("something failed")
+    )
+    urls = ["https://some-website.com/1", "https://some-website.com/2"]
+    html = html_crawler.HTMLCrawler()
+    assert [html.fetch(url) for url in urls] == [{}, {}]
+    recorded = list(helpers.read_error_urls())
+    assert sorted(entry["url"] for entry in recorded) == urls
+    assert all(isinstance(entry["ts"], float) for entry in recorded)
+
+
+def test_helpers_get_uses_shared_session(mocker, response_object):
+    get = mocker.patch.object(
+        sessions.SESSION, "get",
+        return_value=response_object(text="<html></html>"))
+    resp = helpers.get("https://some-website.com/some-path")
+    assert resp.ok
+    get.assert_called_once_with(
+        "https://some-website.com/some-path", timeout=1)
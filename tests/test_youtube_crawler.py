@@ -1,36 +1,38 @@
+import collections
+import pathlib
+import pickle
+
 import pytest
 
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import (
+    NoSuchElementException, WebDriverException)
+from selenium.webdriver.common.by import By
 
 from sylli_crawl import js_crawler
-from sylli_crawl.utils import driver_manager
-
-
-class MockDriver:
-    def __init__(self, page_source=None):
-        print("created driver")
-        self.page_source = page_source
-
-    def __enter__(self):
-        return self
+from sylli_crawl.utils import driver_manager, helpers
+from tests.mocks import MockDriver
 
-    def get(self, url):
-        print("calling mock get function")
-        return self.page_source
+# mock.patch targets used across this module
+GET_DRIVER_PATCH = "sylli_crawl.utils.driver_manager.get_driver"
+INIT_DRIVER_PATCH = "sylli_crawl.utils.driver_manager.init_driver"
+YT_CONSENT_PATCH = "sylli_crawl.js_crawler.YoutubeCrawler.consent"
+YT_SAVE_COOKIES_PATCH = "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies"
+YT_LOAD_COOKIES_PATCH = "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies"
 
 
-@pytest.fixture
-def driver(*args, **kwargs):
-    def inner(*args, **kwargs):
-        print("creating driver")
-        driver = MockDriver(page_source=kwargs["page_source"])
-        return driver
-    return inner
+def _mock_yt_driver(mocker, driver):
+    # the standard setup for driving YoutubeCrawler without a browser:
+    # no consent or cookie handling and get_driver hands out `driver`
+    mocker.patch(YT_CONSENT_PATCH, return_value=None)
+    mocker.patch(YT_SAVE_COOKIES_PATCH, return_value=None)
+    mocker.patch(YT_LOAD_COOKIES_PATCH, return_value=None)
+    mocker.patch(
+        GET_DRIVER_PATCH).return_value.__enter__.return_value = driver
 
 
 def test_failed_driver(mocker):
     mocker.patch(
-        "sylli_crawl.utils.driver_manager.init_driver",
+        INIT_DRIVER_PATCH,
         side_effect=WebDriverException("some exception")
     )
     # we expect a runtime error because the driver wont yield
@@ -39,180 +41,386 @@ def test_failed_driver(mocker):
     # a WebDriverException has been raised
     try:
         with driver_manager.get_driver() as driver:
-            print("we have a driver")
             assert False
     except WebDriverException:
         assert True
 
 
-def test_channel_name_found(mocker, mock_request, driver):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.consent",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.utils.driver_manager.get_driver"
-    ).return_value.__enter__.return_value = MockDriver(
-        page_source=mock_request("test-youtube-cp.html"))
+@pytest.mark.parametrize("raw_html, expected", [
+    (
+        "test-youtube-cp.html",
+        {
+            "url": "https://some-website.com/some-path",
+            "title": "K-d Trees - Computerphile",
+            "author": "Computerphile",
+            "type": "V",
+            "source": "https://some-website.com",
+        },
+    ),
+    (
+        "test-youtube-on-debian.html",
+        {
+            "url": "https://some-website.com/some-path",
+            "title": "RealestK -  SWM (Official Music video)",
+            "author": "RealestK",
+            "type": "V",
+            "source": "https://some-website.com",
+        },
+    ),
+    ("test-youtube-captcha.html", {}),
+])
+def test_fetch(mocker, mock_request, raw_html, expected, yt):
+    _mock_yt_driver(mocker, MockDriver(page_source=mock_request(raw_html)))
+    assert yt.fetch("https://some-website.com/some-path") == expected
+
+
+# the soup fallback on its own, one page with the consent modal and one
+# without it
+@pytest.mark.parametrize("raw_html, expected", [
+    ("test-youtube-cp.html", "Computerphile"),
+    ("test-youtube-on-debian.html", "RealestK"),
+])
+def test_channel_name_found(mock_request, raw_html, expected, yt):
+    bs4_obj = yt.parse_page(mock_request(raw_html))
+    assert yt._channel_name(bs4_obj) == expected
+
+
+@pytest.mark.parametrize("raw_html, expected", [
+    ("test-youtube-cp.html", "K-d Trees - Computerphile"),
+    ("test-youtube-on-debian.html", "RealestK -  SWM (Official Music video)"),
+])
+def test_video_title_found(mock_request, raw_html, expected, yt):
+    bs4_obj = yt.parse_page(mock_request(raw_html))
+    assert yt._video_title(bs4_obj) == expected
+
+
+@pytest.mark.parametrize("raw_html,expected",
+    [
+        ("test-youtube-captcha.html", True),
+        ("test-youtube-on-debian.html", False)
+    ]
+)
+def test_has_captch(mock_request, raw_html, expected, yt):
+
+    page_source = mock_request(raw_html)
+    parsed = yt.parse_page(page_source)
+    assert yt.has_captcha(parsed) == expected
+
+
+@pytest.mark.parametrize("raw_html, expected", [
+    ('<form id="captcha-form"></form>', True),
+    ('<div class="g-recaptcha"></div>', True),
+    ('<div id="infoDiv">Please complete the CAPTCHA</div>', True),
+    ('<div id="infoDiv">Nothing to see here</div>', False),
+])
+def test_has_captcha_markers(raw_html, expected, yt):
+    parsed = yt.parse_page(raw_html)
+    assert yt.has_captcha(parsed) == expected
 
-    url = "https://some-website.com/some-path"
-    js = js_crawler.YoutubeCrawler()
-    parsed_html = js._request(url)
-    actual_channel_name = js._channel_name(parsed_html)
-    expected_channel_name = "Computerphile"
-    assert actual_channel_name == expected_channel_name
 
+def test_driver_reused(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
+    init_driver = mocker.patch(INIT_DRIVER_PATCH)
 
-def test_video_title_found(mocker, mock_request):
-    mocker.patch("time.sleep", return_value=None)
+    with driver_manager.get_driver() as first:
+        pass
+    with driver_manager.get_driver() as second:
+        pass
+
+    assert first is second
+    assert init_driver.call_count == 1
+    # nothing is shut down until the program exits
+    assert not first.quit.called
+    driver_manager.quit_idle_drivers()
+    assert first.quit.called
+
+
+def test_driver_in_use_not_shared(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.consent",
-        return_value=None
+        INIT_DRIVER_PATCH,
+        side_effect=lambda **_: mocker.Mock()
     )
+
+    with driver_manager.get_driver() as first:
+        with driver_manager.get_driver() as second:
+            assert first is not second
+
+
+def test_broken_driver_not_reused(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
+    init_driver = mocker.patch(INIT_DRIVER_PATCH)
+
+    with pytest.raises(WebDriverException):
+        with driver_manager.get_driver():
+            raise WebDriverException("browser crashed")
+
+    assert init_driver.return_value.quit.called
+    assert not driver_manager._IDLE_DRIVERS[(True, True)]
+
+
+def test_driver_reset_before_reuse(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
+    init_driver = mocker.patch(INIT_DRIVER_PATCH)
+
+    with driver_manager.get_driver() as driver:
+        driver.get("https://www.youtube.com/watch?v=1234")
+
+    driver.get.assert_called_with("about:blank")
+    # cookies are kept for the next request
+    assert not driver.delete_all_cookies.called
+    assert driver_manager._IDLE_DRIVERS[(True, True)] == [init_driver.return_value]
+
+
+@pytest.mark.parametrize("lightweight, image_pref", [(True, 2), (False, None)])
+def test_lightweight_firefox_prefs(lightweight, image_pref):
+    options = driver_manager._firefox_options(lightweight=lightweight)
+    assert options.preferences.get("permissions.default.image") == image_pref
+
+
+def test_drivers_pooled_per_setup(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies",
-        return_value=None
+        INIT_DRIVER_PATCH,
+        side_effect=lambda **_: mocker.Mock()
     )
+
+    with driver_manager.get_driver() as first:
+        pass
+    with driver_manager.get_driver(lightweight=False) as second:
+        pass
+
+    assert first is not second
+
+
+def test_idle_drivers_bounded(mocker):
+    mocker.patch.object(
+        driver_manager, "_IDLE_DRIVERS", collections.defaultdict(list))
+    mocker.patch.object(driver_manager, "MAX_IDLE_DRIVERS", 1)
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies",
-        return_value=None
+        INIT_DRIVER_PATCH,
+        side_effect=lambda **_: mocker.Mock()
     )
-    mocker.patch(
-        "sylli_crawl.utils.driver_manager.get_driver"
-    ).return_value.__enter__.return_value = MockDriver(
-        page_source=mock_request("test-youtube-cp.html"))
 
-    url = "https://some-website.com/some-path"
+    with driver_manager.get_driver() as first:
+        with driver_manager.get_driver() as second:
+            pass
+
+    assert driver_manager._IDLE_DRIVERS[(True, True)] == [second]
+    assert first.quit.called
+
+
+def test_wait_until_returns_early(mocker):
+    sleep = mocker.patch("time.sleep", return_value=None)
+    driver = MockDriver(page_source="<html></html>")
+    assert driver_manager.wait_until(driver, lambda d: d.page_source, 10)
+    assert not sleep.called
+
+
+def test_wait_until_times_out(mocker):
+    driver = MockDriver(page_source="")
+    assert not driver_manager.wait_until(driver, lambda d: d.page_source, 0)
+
+
+def test_wait_for_any_element(mocker):
+    driver = mocker.Mock()
+    consent_form = object()
+    driver.find_element.side_effect = [
+        NoSuchElementException("no channel link"), consent_form]
+    condition = driver_manager.any_element_present(
+        js_crawler.YT_READY_LOCATOR, js_crawler.YT_CONSENT_LOCATOR)
+    assert condition(driver) is consent_form
+    assert driver.find_element.call_args.args == (
+        By.CSS_SELECTOR, "tp-yt-paper-dialog#dialog")
+
+
+def test_wait_for_any_element_none_found(mocker):
+    driver = mocker.Mock()
+    driver.find_element.side_effect = NoSuchElementException("nothing")
+    condition = driver_manager.any_element_present(
+        js_crawler.YT_READY_LOCATOR, js_crawler.YT_CONSENT_LOCATOR)
+    assert condition(driver) is False
+    assert driver.find_element.call_count == 2
+
+
+def test_page_streamed_not_soup_parsed(mocker, mock_request):
+    _mock_yt_driver(
+        mocker, MockDriver(page_source=mock_request("test-youtube-cp.html")))
+    parse_page = mocker.spy(js_crawler.YoutubeCrawler, "parse_page")
+
     js = js_crawler.YoutubeCrawler()
-    parsed_html = js._request(url)
-    actual_video_title = js._video_title(parsed_html)
-    expected_video_title = "K-d Trees - Computerphile"
-    assert actual_video_title == expected_video_title
+    js.fetch("https://some-website.com/some-path")
+    assert parse_page.call_count == 0
 
 
-def test_full_fetch(mocker, mock_request):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.consent",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies",
-        return_value=None
-    )
+@pytest.mark.parametrize("raw_html", [
+    "test-youtube-cp.html",
+    "test-youtube-on-debian.html",
+    "test-youtube-on-debian-2.html",
+    "test-youtube-captcha.html",
+])
+def test_streamed_fields_match_soup(mock_request, raw_html, yt):
+    page_source = mock_request(raw_html)
+    assert yt._stream_fields(page_source) == yt._soup_fields(page_source)
+
+
+def test_page_fields_falls_back_to_soup(mocker, mock_request, yt):
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies",
-        return_value=None
+        "sylli_crawl.js_crawler.YoutubeCrawler._stream_fields",
+        side_effect=js_crawler.etree.ParserError("bad page")
     )
-    mocker.patch(
-        "sylli_crawl.utils.driver_manager.get_driver"
-    ).return_value.__enter__.return_value = MockDriver(
-        page_source=mock_request("test-youtube-cp.html"))
+    fields = yt.page_fields(mock_request("test-youtube-on-debian.html"))
+    assert fields["title"] == "RealestK -  SWM (Official Music video)"
+    assert fields["channel"] == "RealestK"
+
+
+def test_page_source_read_once(mocker, mock_request):
+    driver = mocker.Mock()
+    page_source = mocker.PropertyMock(
+        return_value=mock_request("test-youtube-cp.html"))
+    type(driver).page_source = page_source
+    _mock_yt_driver(mocker, driver)
 
-    url = "https://some-website.com/some-path"
     js = js_crawler.YoutubeCrawler()
-    actual_out = js.fetch(url)
-    print(actual_out)
-    expected_out = {
-        "url": url,
-        "title": "K-d Trees - Computerphile",
-        "author": "Computerphile",
-        "type": "V",
-        "source": "https://some-website.com",
-    }
-    assert actual_out == expected_out
-
-
-def test_youtube_request_on_remote_machine(mocker, mock_request):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.consent",
-        return_value=None
-    )
+    js._request("https://some-website.com/some-path")
+    assert page_source.call_count == 1
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.youtube.com/watch?v=1", "youtube"),
+    ("https://youtube.com/watch?v=1", "youtube"),
+    ("https://M.YouTube.com:443/watch?v=1", "youtube"),
+    ("https://www.khanacademy.org/some-page", "khan"),
+    ("https://fr.khanacademy.org/some-page", "khan"),
+    ("https://some-site.com/?next=youtube.com", None),
+    ("https://notyoutube.com/watch?v=1", None),
+])
+def test_js_fetch_dispatch(mocker, url, expected):
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies",
-        return_value=None
+        "sylli_crawl.js_crawler.KhanAcademyCralwer.fetch",
+        return_value={"source": "khan"}
     )
     mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies",
-        return_value=None
+        "sylli_crawl.js_crawler.YoutubeCrawler.fetch",
+        return_value={"source": "youtube"}
     )
-    mocker.patch(
-        "sylli_crawl.utils.driver_manager.get_driver"
-    ).return_value.__enter__.return_value = MockDriver(
-        page_source=mock_request("test-youtube-on-debian.html"))
+    actual_out = js_crawler.JavascriptCrawler().fetch(url)
+    assert actual_out.get("source") == expected
+
+
+def test_cookies_loaded_once_per_driver(mocker, mock_request, tmpdir):
+    mocker.patch.object(helpers, "COOKIE_PATH", pathlib.Path(tmpdir))
+    (pathlib.Path(tmpdir) / "youtube-cookie.json").write_bytes(b"[]")
+    _mock_yt_driver(
+        mocker, MockDriver(page_source=mock_request("test-youtube-cp.html")))
+    load_cookies = mocker.patch(YT_LOAD_COOKIES_PATCH, return_value=None)
 
-    url = "https://some-website.com/some-path"
     js = js_crawler.YoutubeCrawler()
-    actual_out = js.fetch(url)
-    print(actual_out)
-    expected_out = {
-        "url": url,
-        "title": "RealestK -  SWM (Official Music video)",
-        "author": "RealestK",
-        "type": "V",
-        "source": "https://some-website.com",
-    }
-    assert actual_out == expected_out
+    js._request("https://www.youtube.com/watch?v=1")
+    js._request("https://www.youtube.com/watch?v=2")
+    assert load_cookies.call_count == 1
 
 
-@pytest.mark.parametrize("raw_html,expected",
-    [
-        ("test-youtube-captcha.html", True),
-        ("test-youtube-on-debian.html", False)
+def test_cookies_loaded_before_page(mocker, mock_request, tmpdir):
+    mocker.patch.object(helpers, "COOKIE_PATH", pathlib.Path(tmpdir))
+    cookie = {"name": "CONSENT", "value": "NO"}
+    helpers.write_json([cookie], pathlib.Path(tmpdir) / "youtube-cookie.json")
+    driver = mocker.Mock()
+    driver.page_source = mock_request("test-youtube-cp.html")
+    # the standard setup, but with the real load_cookies put back on top
+    load_cookies = js_crawler.YoutubeCrawler.load_cookies
+    _mock_yt_driver(mocker, driver)
+    mocker.patch(YT_LOAD_COOKIES_PATCH, load_cookies)
+
+    js = js_crawler.YoutubeCrawler()
+    js._request("https://www.youtube.com/watch?v=1")
+    assert driver.mock_calls[:3] == [
+        mocker.call.get("https://www.youtube.com/robots.txt"),
+        mocker.call.add_cookie(cookie),
+        mocker.call.get("https://www.youtube.com/watch?v=1"),
     ]
-)
-def test_has_captch(mock_request, raw_html, expected):
+    assert not driver.refresh.called
+
+
+def test_cookie_file_read_once(mocker, tmpdir):
+    mocker.patch.object(helpers, "COOKIE_PATH", pathlib.Path(tmpdir))
+    cookie = {"name": "CONSENT", "value": "NO"}
+    helpers.write_json([cookie], pathlib.Path(tmpdir) / "youtube-cookie.json")
+    read_json = mocker.spy(helpers, "read_json")
+    first, second = mocker.Mock(), mocker.Mock()
 
-    page_source = mock_request(raw_html)
     js = js_crawler.YoutubeCrawler()
-    parsed = js.parse_page(page_source)
-    assert js.has_captcha(parsed) == expected
+    js.load_cookies(first)
+    js.load_cookies(second)
+    assert read_json.call_count == 1
+    second.add_cookie.assert_called_once_with(cookie)
 
 
-@pytest.mark.parametrize("raw_html,expected",
-    [
-        ("test-youtube-captcha.html", {}),
-        ("test-youtube-on-debian.html",
-            {
-                "url": "https://some-website.com/some-path",
-                "title": "RealestK -  SWM (Official Music video)",
-                "author": "RealestK",
-                "type": "V",
-                "source": "https://some-website.com",
-            }
-        )
-    ]
-)
-def test_captcha_from_fetch(mocker, mock_request, raw_html, expected):
-    mocker.patch("time.sleep", return_value=None)
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.consent",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.save_cookies",
-        return_value=None
-    )
-    mocker.patch(
-        "sylli_crawl.js_crawler.YoutubeCrawler.load_cookies",
-        return_value=None
-    )
+def test_pickled_cookies_converted(mocker, tmpdir):
+    mocker.patch.object(helpers, "COOKIE_PATH", pathlib.Path(tmpdir))
+    cookie = {"name": "CONSENT", "value": "NO"}
+    with open(pathlib.Path(tmpdir) / "youtube-cookie.pkl", "wb") as fd:
+        pickle.dump([cookie], fd)
+    driver = mocker.Mock()
+
+    js = js_crawler.YoutubeCrawler()
+    assert js.cookie_file_exists
+    js.load_cookies(driver)
+    driver.add_cookie.assert_called_once_with(cookie)
+    assert helpers.read_json(js.cookie_file) == [cookie]
+
+
+def test_cookies_saved_as_json_for_pickle_path(mocker, tmp_path):
+    cookie = {"name": "CONSENT", "value": "NO"}
+    driver = mocker.Mock()
+    driver.get_cookies.return_value = [cookie]
     mocker.patch(
-        "sylli_crawl.utils.driver_manager.get_driver"
-    ).return_value.__enter__.return_value = MockDriver(
-        page_source=mock_request(raw_html))
+        "sylli_crawl.utils.helpers.get_driver"
+    ).return_value.__enter__.return_value = driver
+
+    helpers.save_cookies(tmp_path / "cookies.pkl", "https://some-website.com")
+    assert not (tmp_path / "cookies.pkl").exists()
+    assert helpers.read_cookies(tmp_path / "cookies.json") == [cookie]
+
+
+def test_cookies_saved_once(mocker, tmpdir):
+    mocker.patch.object(helpers, "COOKIE_PATH", pathlib.Path(tmpdir))
+    driver = mocker.Mock()
+    driver.get_cookies.return_value = [{"name": "CONSENT", "value": "NO"}]
 
-    url = "https://some-website.com/some-path"
     js = js_crawler.YoutubeCrawler()
-    actual_out = js.fetch(url)
-    assert actual_out == expected
+    js.save_cookies(driver)
+    js.save_cookies(driver)
+    assert driver.get_cookies.call_count == 1
+    assert js.cookie_file.exists()
+
+
+def test_khan_parse_page_title():
+    khan = js_crawler.KhanAcademyCralwer()
+    raw_html = (
+        "<html><head><title>Intro to loops (video) | Khan Academy</title>"
+        "</head><body><div><h1>Intro to loops</h1></div></body></html>"
+    )
+    assert khan.parse_page(raw_html) == "Intro to loops (video) | Khan Academy"
+
+
+def test_js_site_crawlers_created_lazily(mocker):
+    youtube = mocker.patch("sylli_crawl.js_crawler.YoutubeCrawler")
+    khan = mocker.patch("sylli_crawl.js_crawler.KhanAcademyCralwer")
+    js = js_crawler.JavascriptCrawler()
+    js.fetch("https://www.khanacademy.org/some-page")
+    js.fetch("https://www.khanacademy.org/some-other-page")
+    assert khan.call_count == 1
+    assert not youtube.called
+
+
+def test_quit_driver_does_not_close_window(mocker):
+    driver = mocker.Mock()
+    driver_manager.quit_driver(driver)
+    assert driver.quit.called
+    assert not driver.close.called